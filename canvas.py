@@ -3,11 +3,59 @@ A module for interacting with Instructure Canvas
 
 Global parameters (most can also be changed on individual function calls):
     base_url: string, containing the base url of canvas server
-    token: string, containing the user access token.
+    token: string, containing the user access token.  If it is not set, it is
+        read from ~/.canvas/access_token when it is first needed.
     this_year: current year, for making class schedules
+    session: a requests.Session shared by all calls, so that connections to
+        the server are kept alive and reused
+    max_workers: number of requests sent at the same time by the functions
+        that fetch all pages of a listing or post many items at once
+    per_page: number of items requested per page of a listing.  Canvas
+        defaults to 10, we ask for its maximum, 100, to need fewer requests
+    cache_ttl: number of seconds the results of read only requests are
+        remembered.  0, the default, turns this off, since changes made in
+        the web interface or by other scripts are not seen while a result is
+        remembered.  Set on import from the environment variable
+        CANVAS_CACHE_TTL, if it is set.  See `contact_server`.
+    rate_limit_threshold: when the server reports less than this much of the
+        rate limit quota remaining, pause for `rate_limit_pause` seconds
+    pandoc_server: url of a running `pandoc server`, which converts markdown
+        instead of a new pandoc process for each conversion.  See
+        `start_pandoc_server`.
+    markdown_cache_dir: directory in which markdown converted by pandoc is
+        kept between runs, None (the default) turns this off
+    compress_threshold: request bodies sent with `compress=True` are gzipped
+        only when longer than this many bytes
+    user_cache_file: file remembering Canvas user ids of sis_login_ids between
+        runs, for example '~/.canvas/user_ids'.  Entries older than
+        `user_cache_ttl` seconds are looked up again.  None (the default)
+        turns this off
 """
-from os.path import expanduser, getsize, basename
+from os import environ, makedirs
+from os.path import expanduser, getsize, basename, dirname, join
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from fnmatch import fnmatchcase
+from contextlib import contextmanager
+from functools import lru_cache, partial, wraps
+from pathlib import Path
+from types import GeneratorType
+from urllib.parse import (urljoin, urlsplit, urlunsplit, parse_qsl,
+                          urlencode)
+import asyncio
+import atexit
+import copy
+import gzip
+import hashlib
+import random
+import re
+import shelve
+import subprocess
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import arrow
 import markdown
 
@@ -17,22 +65,231 @@ try:
 except ImportError:
     HAS_PANDOC = False
 
+HAS_TOOLBELT = True
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    HAS_TOOLBELT = False
+
+HAS_REQUESTS_CACHE = True
+try:
+    import requests_cache
+except ImportError:
+    HAS_REQUESTS_CACHE = False
+
+HAS_BROTLI = True
+try:
+    import brotli  # noqa: F401  (only needed by urllib3 to decode responses)
+except ImportError:
+    HAS_BROTLI = False
+
+HAS_IJSON = True
+try:
+    import ijson
+except ImportError:
+    HAS_IJSON = False
+
+HAS_ORJSON = True
+try:
+    import orjson
+except ImportError:
+    HAS_ORJSON = False
+
+HAS_HTTPX = True
+try:
+    import httpx
+    import h2  # noqa: F401  (only needed by httpx for HTTP/2)
+except ImportError:
+    HAS_HTTPX = False
+
+PANDOC_SPLIT = re.compile(r"<!--PANDOC_SPLIT_\d+-->")
+# Footnotes and link reference definitions, which pandoc resolves across a
+# whole document, and headers, whose generated ids it keeps unique in it.
+MARKDOWN_DEFINITION = re.compile(r"^ {0,3}\[[^]]+\]:|\^\[", re.M)
+MARKDOWN_HEADER = re.compile(
+    r"^ {0,3}#{1,6}[ \t]+(.*)$|^(\S.*)\n {0,3}(?:=+|-+)[ \t]*$", re.M)
+GLOB = re.compile(r"[*?]|\[[^]]+\]")
+LINK = re.compile(r'<([^>]+)>;\s*rel="([^"]+)"')
+
 base_url = "https://svsu.instructure.com/"
-token = 'An invalid token.  Redefine with your own'
+INVALID_TOKEN = 'An invalid token.  Redefine with your own'
+token = INVALID_TOKEN
 this_year = int(arrow.now().format('YYYY'))
+session = requests.Session()
+session.headers['Accept-Encoding'] = \
+    'br, gzip, deflate' if HAS_BROTLI else 'gzip, deflate'
+session.headers['User-Agent'] = 'canvas_scripts {}'.format(
+    requests.utils.default_user_agent())
+max_workers = 8
+per_page = 100
+cache_ttl = int(environ.get('CANVAS_CACHE_TTL', 0))
+cache_size = 512
+cache_lock = threading.Lock()
+response_cache = {}
+function_cache = {}
+stale_cache = {}
+stale_lock = threading.Lock()
+favorite_cache = {}
+listing_etags = {}
+rate_limit_threshold = 100
+rate_limit_pause = 1.0
+compress_threshold = 2048
+markdown_cache_dir = None
+pandoc_server = None
+user_cache_file = None
+user_cache_lock = threading.Lock()
+user_cache_ttl = 30 * 24 * 3600
+
+
+class RateLimitRetry(Retry):
+    """
+    Retry policy that also retries POST requests answered with 429 Too Many
+    Requests.  The server refused those without acting on them, so sending
+    them again cannot create anything twice.  POST requests that fail in any
+    other way are not retried.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        return status_code == 429 or \
+            super().is_retry(method, status_code, has_retry_after)
+
+
+def retry_delay(resp, attempt):
+    """
+    For requests sent without the shared session, like those of
+    `aget_all_pages`: returns how many seconds to wait before sending a
+    request again, after `resp` answered its try number `attempt` (counted
+    from 0), or None if it should not be sent again.  The policy is the one
+    `configure_session` mounted on the shared session: 429 and 5xx answers
+    are retried, as are 403 answers that say that the rate limit was
+    exceeded, which is how Canvas refuses requests sent too fast.  The
+    Retry-After header is honored, otherwise the pause doubles every time.
+    """
+    retry = session.get_adapter('https://').max_retries
+    rate_limited = resp.status_code == 429 or (
+        resp.status_code == 403 and b'Rate Limit Exceeded' in resp.content)
+    if attempt >= (retry.total or 0) or not (
+            rate_limited or resp.status_code in (retry.status_forcelist or
+                                                 ())):
+        return None
+    after = resp.headers.get('Retry-After', '')
+    if after.isdigit():
+        return int(after)
+    return retry.backoff_factor * 2 ** attempt
+
+
+def configure_session(pool_connections=8, pool_maxsize=32, retries=5,
+                      backoff=0.5):
+    """
+    Mount a connection pool of the given size on the shared session.  This is
+    done with the default sizes on import; the pool must be at least as
+    large as `max_workers` for the concurrent helpers to reuse connections.
+    Requests that fail to connect, requests that get a 429 answer, and
+    requests other than POST that get a 5xx answer, are retried with an
+    exponentially increasing pause, honoring the Retry-After header.
+    Parameters:
+        pool_connections: number of per-host pools to cache
+        pool_maxsize: maximum number of connections kept in each pool
+        retries: how many times to retry a failed request, 0 turns this off
+        backoff: the pause before the second retry, in seconds.  It doubles
+            with every retry after that.
+    """
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          max_retries=RateLimitRetry(
+                              total=retries, backoff_factor=backoff,
+                              status_forcelist=(429, 500, 502, 503, 504),
+                              raise_on_status=False))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+def close_session():
+    "Closes the connections of the shared session.  Done when Python exits."
+    session.close()
+
+
+configure_session()
+atexit.register(close_session)
+
+
+def enable_http_cache(cache_file='~/.canvas/http_cache', expire_after=300):
+    """
+    Replace the shared session with a requests_cache session that keeps GET
+    responses in an sqlite database, so that repeated runs of a script do not
+    download unchanged data again.  Cache-Control and ETag headers sent by
+    the server are honored, so stale entries are revalidated cheaply.
+    Calendar events expire after a minute and assignment groups after ten
+    minutes, everything else after `expire_after` seconds.
+
+    This is also done on import when the environment variable CANVAS_CACHE is
+    set to 1.  Requires the requests_cache module.
+    """
+    global session
+
+    if not HAS_REQUESTS_CACHE:
+        print("Warning: requests_cache not available! Not caching.")
+        print("Install requests_cache module to get rid of this error.")
+        return
+
+    cached_session = requests_cache.CachedSession(
+        expanduser(cache_file), backend='sqlite', expire_after=expire_after,
+        cache_control=True, allowable_methods=('GET',),
+        urls_expire_after={
+            '*/calendar_events*': 60,
+            '*/assignment_groups*': 600,
+        })
+    cached_session.headers.update(session.headers)
+    for prefix, adapter in session.adapters.items():
+        cached_session.mount(prefix, adapter)
+    session = cached_session
 
 
 def read_access_token(file='~/.canvas/access_token'):
-    "Read access token if available"
+    """
+    Read access token if available, and make it the global `token`.  Returns
+    the token, or None if it could not be read.
+    """
     global token
     try:
-        with open(expanduser(file), 'r') as f:
-            token = f.read().rstrip('\n')
-    except:
-        print("Could not read access token")
+        token = Path(file).expanduser().read_text().rstrip('\n')
+    except OSError as error:
+        print("Could not read access token: {}".format(error))
+        return None
+    return token
+
+
+@lru_cache(maxsize=1)
+def read_default_access_token():
+    "Reads the access token from the default file, only the first time."
+    return read_access_token()
+
+
+def default_token():
+    """
+    Returns the global `token`.  If it was not set, it is read from the
+    default file first, so that calling `read_access_token` is not necessary
+    when the token is there.
+    """
+    if token == INVALID_TOKEN:
+        read_default_access_token()
+    return token
+
+
+if environ.get('CANVAS_CACHE') == '1':
+    enable_http_cache()
 
 
 # The main purpose for this is that we cannot splat things into a dict :(
+def context_code(course):
+    """
+    Returns the context code 'course_<id>' for a course id.  Same as
+    `course`, which can not be used inside functions with a `course`
+    parameter.
+    """
+    return f"course_{course}"
+
+
 def calendar_event_data(course, title, description, start_at, end_at):
     """
     Creates a dict with parameters for calendar event data to be passed to
@@ -44,7 +301,7 @@ def calendar_event_data(course, title, description, start_at, end_at):
         end_at: ending time, in YYYY-MM-DDTHH:MMZZ format
     """
     event_data = {
-        'calendar_event[context_code]': 'course_{}'.format(course),
+        'calendar_event[context_code]': context_code(course),
         'calendar_event[title]': title,
         'calendar_event[description]': description,
         'calendar_event[start_at]': start_at,
@@ -53,86 +310,771 @@ def calendar_event_data(course, title, description, start_at, end_at):
     return event_data
 
 
-def get_all_pages(orig_url, params=None):
+def decode_json(resp):
+    """
+    Decodes the json body of a response, using orjson when it is available,
+    since it is a lot faster on large listings.
+    """
+    if HAS_ORJSON:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+
+def rate_limit_low(resp):
+    """
+    Does the response say that we are close to exhausting the Canvas rate
+    limit quota?
+    """
+    remaining = resp.headers.get('X-Rate-Limit-Remaining')
+    return remaining is not None and float(remaining) < rate_limit_threshold
+
+
+def wait_for_rate_limit(resp):
+    """
+    Pause for a moment if the response says that we are close to exhausting
+    the Canvas rate limit quota.
+    """
+    if rate_limit_low(resp):
+        time.sleep(rate_limit_pause)
+
+
+def page_url(url, page):
+    "Returns `url` with its `page` query parameter replaced by `page`."
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k != 'page']
+    query.append(('page', page))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def parse_link(header):
+    """
+    Parses a Link header, as sent by Canvas with paginated responses, into a
+    dict in the form {rel: url}.  Unlike `resp.links` of requests, which
+    parses the header again on every access, this is meant to be called once
+    per response.
+    """
+    return {rel: url for url, rel in LINK.findall(header or '')}
+
+
+def page_records(resp, stream=False):
+    """
+    Yields the records from one page of a listing.  If `stream` is true, the
+    response must have been requested with `stream=True`, and the records
+    are parsed incrementally with ijson as they arrive.
+    """
+    if stream:
+        resp.raw.decode_content = True
+        yield from ijson.items(resp.raw, 'item')
+    else:
+        yield from decode_json(resp)
+
+
+def recall(cache, key):
+    """
+    Returns the entry remembered under `key` in `response_cache`,
+    `function_cache`, `favorite_cache` or `listing_etags`, or None.
+    """
+    with cache_lock:
+        return cache.get(key)
+
+
+def remember(cache, key, entry):
+    """
+    Remembers `entry` under `key` in `response_cache`, `function_cache`,
+    `favorite_cache` or `listing_etags`, forgetting the oldest entry when
+    the cache already holds `cache_size` of them.  The caches are shared by
+    the worker threads of the concurrent helpers, so they are only changed
+    while holding `cache_lock`.
+    """
+    with cache_lock:
+        cache.pop(key, None)
+        if len(cache) >= cache_size:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = entry
+
+
+def iter_all_pages(orig_url, params=None, headers=None, stream=False):
     """
     Auxiliary function that uses the 'next' links returned from the server to
-    request additional pages and combine them together into one json response.
+    request additional pages, and yields the json records from all the pages
+    one by one, as the pages arrive.  When the server also sends a 'last' link
+    with a page number, the remaining pages are requested concurrently.
+    Otherwise the 'next' links are followed exactly as given, so that
+    Canvas can use its bookmark pagination.  Unless `params` say otherwise,
+    `per_page` items are requested per page.  A listing that fits on a
+    single page is revalidated with its ETag when it is requested again.
     Parameters:
         orig_url: the url for the original request
-        params: a dict with the parameters for the original request (must
-                    contain access token)
-    Returns:
-        A combined list of json results returned in all pages.
+        params: a dict with the parameters for the original request
+        headers: a dict with request headers (must contain authorization)
+        stream: parse the pages incrementally as they are downloaded, so that
+            a whole page is never held in memory.  The pages are then fetched
+            one after another.  Requires the ijson module.
     Warning:
         Does not handle failure in any way! Make sure you don't kill your pets
         by accident.
     """
-    url = orig_url
-    json = []
+    stream = stream and HAS_IJSON
     if params is None:
         params = {}
-    while True:
-        resp = requests.get(url, params=params)
-        json += resp.json()
-        if 'next' not in resp.links:
-            return json
-        url = resp.links['next']['url']
-        params = {'access_token': params['access_token']}
+    if isinstance(params, dict) and 'per_page' not in params:
+        params = dict(params, per_page=per_page)
+
+    # A listing that fits on one page is remembered with its ETag, and only
+    # downloaded again if the server says that it changed.
+    key = (orig_url, repr(sorted(params.items())) if isinstance(params, dict)
+           else params, (headers or {}).get('Authorization'))
+    cached = None if stream else recall(listing_etags, key)
+    resp = session.get(orig_url, params=params, stream=stream,
+                       headers=headers if cached is None else
+                       dict(headers or {}, **{'If-None-Match': cached[0]}))
+    if cached is not None and resp.status_code == 304:
+        # Copies, so that the caller can not modify the remembered records.
+        yield from copy_result(cached[1])
+        return
+    wait_for_rate_limit(resp)
+    links = parse_link(resp.headers.get('Link'))
+    if not stream and 'next' not in links and 'ETag' in resp.headers:
+        records = decode_json(resp)
+        remember(listing_etags, key, (resp.headers['ETag'], records))
+        yield from copy_result(records)
+        return
+    yield from page_records(resp, stream)
+    if 'next' not in links:
+        return
+
+    last = links.get('last')
+    last_page = dict(parse_qsl(urlsplit(last).query)).get('page') if last \
+        else None
+    if not stream and last_page is not None and last_page.isdigit():
+        def get_page(page):
+            page_resp = session.get(page_url(last, page), headers=headers)
+            wait_for_rate_limit(page_resp)
+            return decode_json(page_resp)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for page in executor.map(get_page,
+                                     range(2, int(last_page) + 1)):
+                yield from page
+        finally:
+            # Do not fetch the rest if the caller stopped early.
+            executor.shutdown(cancel_futures=True)
+        return
+
+    # No usable 'last' link (e.g. bookmark pagination), walk the pages.
+    while 'next' in links:
+        resp = session.get(links['next'], headers=headers, stream=stream)
+        wait_for_rate_limit(resp)
+        yield from page_records(resp, stream)
+        links = parse_link(resp.headers.get('Link'))
+
+
+def iter_streamed_pages(orig_url, params=None, headers=None):
+    """
+    Same as `iter_all_pages` with `stream=True`, for use with
+    `contact_server`.
+    """
+    return iter_all_pages(orig_url, params, headers, stream=True)
+
+
+def get_all_pages(orig_url, params=None, headers=None):
+    """
+    Auxiliary function that requests all pages of a paginated response and
+    combines them together into one json response.  See `iter_all_pages`.
+    Returns:
+        A combined list of json results returned in all pages.
+    """
+    return list(iter_all_pages(orig_url, params, headers))
+
+
+async def aget_all_pages(orig_url, params=None, headers=None):
+    """
+    Awaitable version of `get_all_pages`.  When httpx and h2 are installed,
+    the pages after the first are fetched at the same time, as streams of a
+    single HTTP/2 connection if the server speaks HTTP/2, or over several
+    HTTP/1.1 connections if not.  Otherwise `get_all_pages` is run in a
+    worker thread.  Failed requests are retried like those of the shared
+    session (see `retry_delay`), and CanvasHTTPError is raised if a page
+    can not be had.
+    For example:
+        await aget_all_pages(api_url(base_url, location), None,
+                             auth_headers(default_token()))
+    """
+    if not HAS_HTTPX:
+        return await asyncio.to_thread(get_all_pages, orig_url, params,
+                                       headers)
+
+    if params is None:
+        params = {}
+    if isinstance(params, dict) and 'per_page' not in params:
+        params = dict(params, per_page=per_page)
+
+    # Only headers allowed in HTTP/2: requests' Connection: keep-alive is
+    # connection specific, and h2 refuses to send it.
+    async with httpx.AsyncClient(
+            http2=True,
+            headers={name: session.headers[name]
+                     for name in ('Accept', 'User-Agent')
+                     if name in session.headers}) as client:
+
+        async def get_page(url, params=None):
+            attempt = 0
+            while True:
+                resp = await client.get(url, params=params, headers=headers)
+                delay = retry_delay(resp, attempt)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                attempt += 1
+            if rate_limit_low(resp):
+                await asyncio.sleep(rate_limit_pause)
+            raise_for_canvas(resp)
+            return resp
+
+        resp = await get_page(orig_url, params)
+        records = decode_json(resp)
+        links = parse_link(resp.headers.get('Link'))
+        last_page = None
+        if 'next' in links and 'last' in links:
+            last_page = dict(parse_qsl(urlsplit(links['last']).query)).get(
+                'page')
+
+        if last_page is not None and last_page.isdigit():
+            # At most max_workers pages at once.
+            slots = asyncio.Semaphore(max_workers)
+
+            async def get_numbered(page):
+                async with slots:
+                    return decode_json(
+                        await get_page(page_url(links['last'], page)))
+
+            for page in await asyncio.gather(
+                    *map(get_numbered, range(2, int(last_page) + 1))):
+                records.extend(page)
+            return records
+
+        while 'next' in links:
+            resp = await get_page(links['next'])
+            records.extend(decode_json(resp))
+            links = parse_link(resp.headers.get('Link'))
+    return records
+
+
+@lru_cache(maxsize=512)
+def api_url(base, location):
+    """
+    Joins the server base url and the api location, making sure there is
+    exactly one slash between them.  The result is cached, since the same
+    urls are built over and over.
+    """
+    return urljoin(base if base.endswith('/') else base + '/',
+                   location.lstrip('/'))
+
+
+@lru_cache(maxsize=8)
+def auth_headers(access_token):
+    """
+    Returns a dict with the authorization header for the given access token.
+    The same dict is returned for the same token every time, so it must not
+    be modified.
+    """
+    if __debug__ and access_token == INVALID_TOKEN:
+        print("Warning: no access token set! Call read_access_token first.")
+    return {'Authorization': 'Bearer ' + access_token}
+
+
+def is_read_request(contact_function):
+    "Is `contact_function` one that only reads data from the server?"
+    return (contact_function in (get_all_pages, iter_all_pages,
+                                 iter_streamed_pages, get_json) or
+            contact_function == session.get)
+
+
+def clear_cache():
+    """
+    Forget all the responses remembered by `contact_server`, the results
+    remembered by functions decorated with `ttl_cache`, and the remembered
+    favorite courses.
+    """
+    with cache_lock:
+        response_cache.clear()
+        function_cache.clear()
+        favorite_cache.clear()
+    with stale_lock:
+        stale_cache.clear()
+
+
+def copy_result(result):
+    """
+    Returns a copy of a remembered json `result`, a list or a dict, so that
+    the caller can modify it without modifying the remembered one.  Anything
+    else is returned as it is.
+    """
+    if isinstance(result, (list, dict)):
+        return copy.deepcopy(result)
+    return result
+
+
+def ttl_cache(seconds):
+    """
+    Decorator for functions that read data that rarely changes, like course
+    tabs or group categories.  Their results are remembered for `seconds`,
+    usually longer than `cache_ttl`.  Like the responses remembered by
+    `contact_server`, they are forgotten as soon as any request that may
+    change data is sent, and not remembered at all if `cache_ttl` is 0.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def cached(*args, **kwargs):
+            if cache_ttl <= 0:
+                return function(*args, **kwargs)
+            key = (function.__name__, args, tuple(sorted(kwargs.items())),
+                   base_url, token)
+            now = time.monotonic()
+            entry = recall(function_cache, key)
+            if entry is None or entry[0] <= now:
+                entry = (now + seconds, function(*args, **kwargs))
+                remember(function_cache, key, entry)
+            return copy_result(entry[1])
+
+        return cached
+
+    return decorator
+
+
+def stale_while_revalidate(seconds=None, grace=600):
+    """
+    Decorator for functions that read long paginated listings, like all the
+    submissions of a course.  Their results are remembered for `seconds`
+    (`cache_ttl` if None).  For `grace` seconds after that, the remembered
+    result is still returned at once, while a fresh one is fetched in a
+    background thread, at most one for each set of arguments.  Only older
+    results, or none, make the caller wait.  Like the responses remembered by
+    `contact_server`, they are forgotten as soon as any request that may
+    change data is sent, and not remembered at all if `cache_ttl` is 0.
+    """
+
+    def decorator(function):
+        def refresh(key, args, kwargs):
+            try:
+                result = function(*args, **kwargs)
+                with stale_lock:
+                    if key in stale_cache:
+                        ttl = cache_ttl if seconds is None else seconds
+                        stale_cache[key] = [time.monotonic() + ttl, result,
+                                            False]
+            finally:
+                with stale_lock:
+                    if key in stale_cache:
+                        stale_cache[key][2] = False
+
+        @wraps(function)
+        def cached(*args, **kwargs):
+            if cache_ttl <= 0:
+                return function(*args, **kwargs)
+            # Arguments may be lists, so the key is built from their repr.
+            key = hashlib.sha1(repr((function.__name__, args,
+                                     sorted(kwargs.items()), base_url,
+                                     token)).encode()).hexdigest()
+            now = time.monotonic()
+            with stale_lock:
+                entry = stale_cache.get(key)
+                if entry is not None and entry[0] + grace > now:
+                    if entry[0] <= now and not entry[2]:
+                        entry[2] = True
+                        threading.Thread(target=refresh,
+                                         args=(key, args, kwargs),
+                                         daemon=True).start()
+                    return copy_result(entry[1])
+            result = function(*args, **kwargs)
+            # Do not remember generators, they can be used only once.
+            if not isinstance(result, GeneratorType):
+                ttl = cache_ttl if seconds is None else seconds
+                with stale_lock:
+                    stale_cache.pop(key, None)
+                    if len(stale_cache) >= cache_size:
+                        stale_cache.pop(next(iter(stale_cache)), None)
+                    stale_cache[key] = [now + ttl, result, False]
+                return copy_result(result)
+            return result
+
+        return cached
+
+    return decorator
+
+
+def revalidation_headers(response):
+    """
+    Returns a dict with If-None-Match and If-Modified-Since headers that ask
+    the server whether `response` is still current, based on its ETag and
+    Last-Modified headers.  The dict is empty if `response` is not a
+    response, or has neither of those headers.
+    """
+    conditions = {}
+    if isinstance(response, requests.Response):
+        if 'ETag' in response.headers:
+            conditions['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            conditions['If-Modified-Since'] = response.headers['Last-Modified']
+    return conditions
 
 
 def contact_server(contact_function, location, data=None, base=None,
                    access_token=None):
     """
-    Abstracting a server request. Builds a url from base and location, adds
-    access_token if given, or default token, to data dict, and calls
-    contact_function with the url and data.  Returns the result of the
-    contact_function.
+    Abstracting a server request. Builds a url from base and location, and
+    calls contact_function with the url, data, and authorization headers for
+    access_token if given, or default token.  Returns the result of the
+    contact_function.  Instead of a function, `contact_function` can also be
+    the name of an HTTP verb, like 'post', sent with the shared session.
+
+    The data of POST and PUT requests made with `session.post` and
+    `session.put` is sent form encoded in the request body, the data of other
+    requests in the query string.
+
+    Also accepts a list of pairs as data.  Those are encoded here, in one go,
+    and passed through by requests as they are.  An already encoded string is
+    passed through as well.
+
+    When `cache_ttl` is set (it is 0, off, by default), results of requests
+    that only read data are remembered for `cache_ttl` seconds, and the same
+    request made again in that time returns the remembered result.  After
+    that, a remembered response with an ETag or Last-Modified header is
+    revalidated with a conditional request, and kept if the server answers
+    304 Not Modified.  Any other request clears all remembered results,
+    since it may have changed them.  Callers always get a copy of a
+    remembered result, see `copy_result`.
+    """
+    if isinstance(contact_function, str):
+        contact_function = getattr(session, contact_function.lower())
+    if isinstance(data, list):
+        data = urlencode(data, doseq=True)
+
+    url = api_url(base_url if base is None else base, location)
+    headers = auth_headers(default_token() if access_token is None
+                           else access_token)
+
+    if not is_read_request(contact_function):
+        clear_cache()
+        if contact_function in (session.post, session.put):
+            return contact_function(url, data=data,
+                                    headers=form_headers(data, headers))
+        return contact_function(url, params=data, headers=headers)
+    if cache_ttl <= 0:
+        return contact_function(url, params=data, headers=headers)
+
+    key = (getattr(contact_function, '__name__', None), url,
+           repr(sorted(data.items())) if isinstance(data, dict) else data,
+           headers['Authorization'])
+    now = time.monotonic()
+    cached = recall(response_cache, key)
+    if cached is not None and cached[0] > now:
+        result = cached[1]
+    else:
+        conditions = {} if cached is None else \
+            revalidation_headers(cached[1])
+        if conditions:
+            # Ask the server whether the remembered response is still good.
+            result = contact_function(url, params=data,
+                                      headers=dict(headers, **conditions))
+            if result.status_code == 304:
+                result = cached[1]
+        else:
+            result = contact_function(url, params=data, headers=headers)
+        # Do not remember failures, or generators that can be used only once.
+        if getattr(result, 'ok', True) and \
+                not isinstance(result, GeneratorType):
+            remember(response_cache, key, (now + cache_ttl, result))
+
+    return copy_result(result)
+
+
+class CanvasHTTPError(requests.HTTPError):
+    """
+    Raised when the Canvas server answers with an error.  Besides the
+    `response`, it carries the HTTP `status` code and the decoded json
+    `payload` of the answer (None if the body is not json).
+    """
+
+    def __init__(self, response):
+        try:
+            payload = decode_json(response)
+        except ValueError:
+            payload = None
+        super().__init__('{} Error for url {}: {}'.format(
+            response.status_code, response.url, payload), response=response)
+        self.status = response.status_code
+        self.payload = payload
+
+
+def raise_for_canvas(resp):
+    "Raises CanvasHTTPError if the response `resp` is an error."
+    if resp.status_code >= 400:
+        raise CanvasHTTPError(resp)
 
-    Also accepts a list of pairs as data.
+
+def form_headers(data, headers):
     """
-    if data is None:
-        params = dict()
-    else:
-        params = data.copy()  # prevent them from being clobbered
-    if isinstance(params, dict):
-        params['access_token'] = (
-            token if access_token is None
-            else access_token)
+    Returns the request headers for sending `data` in the request body.  For
+    an already encoded string the content type has to be given explicitly,
+    requests only sets it for a dict.
+    """
+    if isinstance(data, str):
+        return dict(headers,
+                    **{'Content-Type': 'application/x-www-form-urlencoded'})
+    return headers
+
+
+def compact_params(params):
+    """
+    Returns a copy of the dict `params` without the parameters that are None
+    or False, that is, filters that were not asked for.  Returns None if none
+    are left, so that no query string is sent at all.
+    """
+    params = {key: value for key, value in params.items()
+              if value is not None and value is not False}
+    return params or None
+
+
+def form_data(prefix=None, **fields):
+    """
+    Builds the form data of a request from keyword arguments, named the way
+    Canvas expects them: `form_data('module', name='A')` gives
+    {'module[name]': 'A'}, without a prefix just {'name': 'A'}.  Fields that
+    are None are left out, booleans are sent as 1 or 0, lists and tuples
+    get a [] suffix so that Canvas takes them as arrays, and dicts are nested
+    the same way.
+    """
+    data = {}
+    for key, value in fields.items():
+        name = key if prefix is None else f'{prefix}[{key}]'
+        if value is None:
+            continue
+        if isinstance(value, dict):
+            data.update(form_data(name, **value))
+        elif isinstance(value, (list, tuple)):
+            data[name + '[]'] = list(value)
+        elif isinstance(value, bool):
+            data[name] = int(value)
+        else:
+            data[name] = value
+    return data
+
+
+def call_json(method, url, params=None, headers=None):
+    """
+    A contact function for `contact_server` that sends a request with the
+    given HTTP method using the shared session, raises CanvasHTTPError if
+    the request fails, and returns the decoded json response.  Use the
+    `get_json`, `post_json`, `put_json` and `delete_json` shortcuts.  POST
+    and PUT data is sent in the request body.
+
+    A GET answer with an ETag is remembered together with it, like a
+    listing that fits on one page in `iter_all_pages`, and is only
+    downloaded again if the server says that it changed.  The caller gets a
+    copy of the remembered answer.
+    """
+    if method in ('POST', 'PUT'):
+        resp = session.request(method, url, data=params,
+                               headers=form_headers(params, headers))
+    elif method == 'GET':
+        key = (url, repr(sorted(params.items())) if isinstance(params, dict)
+               else params, (headers or {}).get('Authorization'))
+        cached = recall(listing_etags, key)
+        resp = session.get(url, params=params,
+                           headers=headers if cached is None else
+                           dict(headers or {},
+                                **{'If-None-Match': cached[0]}))
+        if cached is not None and resp.status_code == 304:
+            return copy_result(cached[1])
+        raise_for_canvas(resp)
+        result = decode_json(resp)
+        if 'ETag' in resp.headers:
+            remember(listing_etags, key, (resp.headers['ETag'], result))
+            return copy_result(result)
+        return result
     else:
-        params += [('access_token',
-                    token if access_token is None
-                    else access_token)]
+        resp = session.request(method, url, params=params, headers=headers)
+    raise_for_canvas(resp)
+    return decode_json(resp)
 
-    return contact_function((base_url if base is None else base) + location,
-                            params=params)
 
+get_json = partial(call_json, 'GET')
+post_json = partial(call_json, 'POST')
+put_json = partial(call_json, 'PUT')
+delete_json = partial(call_json, 'DELETE')
 
-def progress(prog_url, access_token=None):
+
+def send_compressed(method, url, params=None, headers=None):
     """
-    Iterator that repeatedly checks progress from the given url.  It yields the
-    json results of the progress query.  It stops when workflow state is no
-    longer queued nor running.
+    A contact function for `contact_server` that sends the data form encoded
+    in the request body, gzipped if it is longer than `compress_threshold`
+    bytes.  Only useful with servers that accept compressed request bodies.
+    Use the `post_compressed` and `put_compressed` shortcuts.
     """
+    body = (params if isinstance(params, str)
+            else urlencode(params or {}, doseq=True)).encode('utf-8')
+    headers = form_headers('', headers)
+    if len(body) > compress_threshold:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    return session.request(method, url, data=body, headers=headers)
+
+
+post_compressed = partial(send_compressed, 'POST')
+put_compressed = partial(send_compressed, 'PUT')
+
+
+def make_endpoint(contact_function, location, fixed_params=None):
+    """
+    Prepares a request to an api endpoint that is used repeatedly with the
+    same fixed parameters.  Returns a function that takes a dict of the
+    varying parameters, optional `base` and `access_token`, and keyword
+    arguments that are filled into the `{}` fields of `location`, and calls
+    `contact_server`.
+    Example:
+        list_events = make_endpoint(get_all_pages,
+                                    'api/v1/courses/{course}/calendar_events',
+                                    {'type': 'event'})
+        list_events({'all_events': 1}, course=1234)
+    """
+    fixed_params = {} if fixed_params is None else fixed_params
+
+    def endpoint(params=None, base=None, access_token=None, **path_args):
+        return contact_server(contact_function,
+                              location.format_map(path_args),
+                              fixed_params if params is None
+                              else dict(fixed_params, **params),
+                              base, access_token)
 
+    return endpoint
+
+
+def bulk(submitters, workers=None):
+    """
+    Calls independent functions concurrently, so that their requests to the
+    server overlap.  Mind that Canvas rate limits apply: when a result is a
+    response saying that the quota is running low, the worker that got it
+    pauses before taking up the next call.
+    Parameters:
+        submitters: an iterable of functions without arguments, for example
+            `partial(create_module_item, course, module, ...)`
+        workers: number of calls made at the same time, defaults to the
+            global `max_workers`.  With 1, the calls are made one after
+            another in the calling thread.
+    Returns a list of the results of the calls, in order.
+    """
+
+    def submit(submitter):
+        result = submitter()
+        if isinstance(result, requests.Response):
+            wait_for_rate_limit(result)
+        return result
+
+    workers = workers or max_workers
+    if workers == 1:
+        # Plain sequential calls in this thread, easier to debug.
+        return [submit(submitter) for submitter in submitters]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(submit, submitters))
+
+
+def progress_states(prog_url, access_token=None, min_interval=0.5,
+                    max_interval=15.0):
+    """
+    Does the work for `progress` and `progress_async`.  Yields pairs of the
+    json result of a progress query (None if there is nothing to report) and
+    the number of seconds to wait before the next query (None after the last
+    one).  If the query fails, the json error is yielded first, so that the
+    caller sees the final state, and CanvasHTTPError is raised after that.
+    """
+
+    headers = auth_headers(default_token() if access_token is None
+                           else access_token)
+    attempts = 0
+    last_status = None
     while True:
-        resp = requests.get(prog_url,
-                            data={'access_token': token if access_token is None
-                                  else access_token})
-        resp.raise_for_status()
-        json = resp.json()
-        yield json
+        resp = session.get(prog_url, headers=headers)
+        if resp.status_code in (429, 503) and 'Retry-After' in resp.headers:
+            retry_after = resp.headers['Retry-After']
+            yield None, (float(retry_after) if retry_after.isdigit()
+                         else max_interval)
+            continue
+        if resp.status_code >= 400:
+            error = CanvasHTTPError(resp)
+            yield error.payload, None
+            raise error
+        json = decode_json(resp)
         status = json['workflow_state']
         if status != 'queued' and status != 'running':
+            yield json, None
             break
+        if status != last_status:
+            attempts = 0
+            last_status = status
+        yield json, min(max_interval,
+                        min_interval * 2**attempts + random.random() * 0.25)
+        attempts += 1
+
+
+def progress(prog_url, access_token=None, min_interval=0.5,
+             max_interval=15.0):
+    """
+    Iterator that repeatedly checks progress from the given url.  It yields the
+    json results of the progress query.  It stops when workflow state is no
+    longer queued nor running.
+
+    Between the queries it waits, starting with `min_interval` seconds and
+    doubling the wait (up to `max_interval`) for as long as the state does not
+    change.  If the server asks us to slow down with a `Retry-After` header,
+    it waits as long as the server wants.  If a query fails, its json error
+    is yielded, and then CanvasHTTPError is raised.
+    """
+
+    for json, delay in progress_states(prog_url, access_token, min_interval,
+                                       max_interval):
+        if json is not None:
+            yield json
+        if delay is not None:
+            time.sleep(delay)
+
+
+async def progress_async(prog_url, access_token=None, min_interval=0.5,
+                         max_interval=15.0):
+    """
+    Same as `progress`, but an asynchronous iterator, to be used with
+    `async for`.  Other tasks keep running while it waits between queries.
+    """
+
+    states = progress_states(prog_url, access_token, min_interval,
+                             max_interval)
+    while True:
+        state = await asyncio.to_thread(next, states, None)
+        if state is None:
+            return
+        json, delay = state
+        if json is not None:
+            yield json
+        if delay is not None:
+            await asyncio.sleep(delay)
 
 
 def create_calendar_event(event_data, base=None, access_token=None):
-    "Post an event described by `event_data` dict to a calendar"
+    """Post an event described by `event_data` dict (or an already urlencoded
+    string) to a calendar"""
 
-    return contact_server(requests.post, 'api/v1/calendar_events.json',
+    return contact_server(session.post, 'api/v1/calendar_events.json',
                           event_data, base, access_token)
 
 
+list_calendar_events = make_endpoint(get_all_pages,
+                                     'api/v1/calendar_events.json',
+                                     {'type': 'event'})
+
+
 def list_calendar_events_between_dates(course, start_date, end_date, base=None,
                                        access_token=None):
     """Lists all events in a given course between two dates.
@@ -145,14 +1087,11 @@ def list_calendar_events_between_dates(course, start_date, end_date, base=None,
     Returns a list of json descriptions of events.
     """
 
-    return contact_server(get_all_pages, 'api/v1/calendar_events.json',
-                          {
-                              'type': 'event',
-                              'start_date': start_date,
-                              'end_date': end_date,
-                              'context_codes[]': 'course_{}'.format(course),
-                          },
-                          base, access_token)
+    return list_calendar_events({
+        'start_date': start_date,
+        'end_date': end_date,
+        'context_codes[]': context_code(course),
+    }, base, access_token)
 
 
 def list_calendar_events_all(course, base=None, access_token=None):
@@ -163,34 +1102,35 @@ def list_calendar_events_all(course, base=None, access_token=None):
         access_token: optional access token, if different from global one
     """
 
-    return contact_server(get_all_pages, 'api/v1/calendar_events.json',
-                          {
-                              'type': 'event',
-                              'all_events': True,
-                              'context_codes[]': 'course_{}'.format(course),
-                          },
-                          base, access_token)
+    return list_calendar_events({
+        'all_events': 1,
+        'context_codes[]': context_code(course),
+    }, base, access_token)
 
 
 def delete_event(event_id, base=None, access_token=None):
     """Deletes an event, specified by 'event_id'. Returns the event."""
 
-    return contact_server(requests.delete,
-                          'api/v1/calendar_events/{}'.format(event_id),
-                          {
-                              'cancel_reason': 'no reason',
-                              'access_token': access_token
-                          },
+    return contact_server(session.delete,
+                          f'api/v1/calendar_events/{event_id}',
+                          {'cancel_reason': 'no reason'},
                           base, access_token)
 
 
+# From the first class of the week to the second, and from the second to the
+# first class of the next week.
+CLASS_STEPS = (timedelta(days=2), timedelta(days=5))
+
+
 def class_span(start, length):
     """Returns class starting and ending time in isoformat.  To be used with
     `calendar_event_data`. Parameters:
-        start: an arrow object describing class starting time
+        start: an arrow (or datetime) object describing class starting time
         length: length of class in minutes
     """
-    return start.isoformat(), start.replace(minutes=length).isoformat()
+    if isinstance(start, arrow.Arrow):
+        start = start.datetime
+    return start.isoformat(), (start + timedelta(minutes=length)).isoformat()
 
 
 def firstclass(month, day, hour, minute, year=this_year):
@@ -202,7 +1142,7 @@ def firstclass(month, day, hour, minute, year=this_year):
 
 
 def create_events_from_list(course, event_list, start, length, base=None,
-                            access_token=None):
+                            access_token=None, workers=None):
     """
     Creates a series of events for a MW or TR class. Parameters:
         course: a course id, string or int
@@ -212,15 +1152,78 @@ def create_events_from_list(course, event_list, start, length, base=None,
         start: an arrow object describing the starting time of the first class.
             Must be Monday or Tuesday!
         length: int, length of class in minutes
+        workers: number of events posted to the server at the same time,
+            defaults to the global `max_workers`
+    Returns a list of responses, one for each created event, in order.
+    """
+    # All the dates are computed up front, so that the workers only do the
+    # talking to the server.
+    spans = []
+    classtime = start.datetime
+    for i in range(len(event_list)):
+        spans.append(class_span(classtime, length))
+        classtime += CLASS_STEPS[i % 2]
+
+    # The context code is the same for all the events, so it is encoded only
+    # once, and each event only encodes its own fields.
+    context = urlencode({
+        'calendar_event[context_code]': context_code(course)})
+    events = [urlencode({
+        'calendar_event[title]': event[0],
+        'calendar_event[description]': event[1],
+        'calendar_event[start_at]': span[0],
+        'calendar_event[end_at]': span[1],
+    }) + '&' + context
+        for event, span in zip(event_list, spans) if event[0] != ""]
+
+    return bulk([partial(create_calendar_event, event_data, base,
+                         access_token)
+                 for event_data in events], workers)
+
+
+def start_pandoc_server(port=3030):
+    """
+    Starts `pandoc server` (pandoc 3.0 or newer) in the background and sets
+    `pandoc_server` to it, so that markdown is converted without starting a
+    new pandoc process every time.  The server is stopped when Python exits.
+    Returns the server process.
+    """
+    global pandoc_server
+
+    if not HAS_PANDOC:
+        print("Warning: pypandoc not available! Not starting pandoc server.")
+        print("Install pypandoc module to get rid of this error.")
+        return None
+
+    process = subprocess.Popen(
+        [pypandoc.get_pandoc_path(), 'server', '--port', str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    atexit.register(process.terminate)
+    pandoc_server = 'http://127.0.0.1:{}/'.format(port)
+    return process
+
+
+def run_pandoc(text):
     """
-    classtime = start
-    for i, event in enumerate(event_list):
-        if event[0] != "":
-            create_calendar_event(
-                calendar_event_data(course, event[0], event[1],
-                                    *class_span(classtime, length)),
-                base, access_token)
-        classtime = classtime.replace(days=2 if i % 2 == 0 else 5)
+    Converts markdown `text` to html with pandoc.  Uses `pandoc_server` when
+    it is set, and starts pandoc when there is no server, or the server can
+    not do it (not running yet, or a pandoc without server mode).
+    """
+
+    if pandoc_server is not None:
+        # Not through the shared session, whose retries would only delay
+        # the fallback when the server is not there.
+        try:
+            resp = requests.post(pandoc_server, json={
+                'text': text, 'from': 'markdown', 'to': 'html',
+                'html-math-method': 'mathml'},
+                headers={'Accept': 'application/json'}, timeout=30)
+            resp.raise_for_status()
+            return decode_json(resp)['output']
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+    return pypandoc.convert_text(text, "html", format="md",
+                                 extra_args=["--mathml"])
 
 
 def convert_markdown(body, use_pandoc):
@@ -234,11 +1237,121 @@ def convert_markdown(body, use_pandoc):
         print("Install pypandoc module to get rid of this error.")
         use_pandoc = False
 
-    if use_pandoc:
-        return pypandoc.convert_text(body, "html", format="md",
-                                     extra_args=["--mathml"])
-    else:
-        return markdown.markdown(body, extensions=['extra'])
+    return cached_convert_markdown(body, use_pandoc)
+
+
+def convert_markdown_batch(bodies, use_pandoc):
+    """
+    Convert a list of markdown strings to a list of html strings.  When pandoc
+    is used, the bodies that were not converted before are converted by a
+    single pandoc run, which saves the pandoc startup time for each of them.
+    Bodies with footnotes or link reference definitions, or with headers
+    named the same as a header of another body, are converted on their own,
+    since pandoc would number, resolve or rename those across the whole run.
+    """
+
+    if not (use_pandoc and HAS_PANDOC):
+        return [convert_markdown(body, use_pandoc) for body in bodies]
+
+    html = [recall_pandoc_html(body) for body in bodies]
+    batch = []
+    headers = set()
+    for i, body in enumerate(bodies):
+        names = header_names(body)
+        if html[i] is None and not MARKDOWN_DEFINITION.search(body) and \
+                not names & headers:
+            batch.append(i)
+            headers |= names
+
+    if len(batch) > 1:
+        joined = "".join(
+            "\n\n<!--PANDOC_SPLIT_{}-->\n\n{}".format(i, bodies[i])
+            for i in batch)
+        parts = PANDOC_SPLIT.split(run_pandoc(joined))[1:]
+        if len(parts) == len(batch):  # otherwise pandoc mangled them
+            for i, part in zip(batch, parts):
+                html[i] = part.strip() + "\n"
+                remember_pandoc_html(bodies[i], html[i])
+
+    return [cached_convert_markdown(body, True) if part is None else part
+            for body, part in zip(bodies, html)]
+
+
+def header_names(body):
+    """
+    Returns the set of the headers of markdown `body`, lower case and with
+    everything but letters and digits left out, which is how pandoc makes
+    the header ids, give or take a few punctuation characters.
+    """
+
+    return {re.sub(r"[\W_]+", "", (atx or setext).lower())
+            for atx, setext in MARKDOWN_HEADER.findall(body)}
+
+
+# Setting up the extensions is much more work than converting a short text, so
+# a single converter is reused.  It is not thread safe, hence the lock.
+markdown_converter = markdown.Markdown(extensions=['extra'])
+markdown_lock = threading.Lock()
+pandoc_cache = {}
+
+
+@lru_cache(maxsize=256)
+def cached_convert_markdown(body, use_pandoc):
+    """
+    Does the actual conversion for `convert_markdown`.  The conversion is a
+    pure function of its arguments, so the results are cached and converting
+    the same markdown again does not start pandoc again.  See also
+    `markdown_cache_dir`.
+    """
+
+    if not use_pandoc:
+        with markdown_lock:
+            return markdown_converter.reset().convert(body)
+
+    html = recall_pandoc_html(body)
+    if html is None:
+        html = run_pandoc(body)
+        remember_pandoc_html(body, html)
+    return html
+
+
+def pandoc_cache_file(body):
+    "The file in `markdown_cache_dir` for the html of markdown `body`."
+    return join(expanduser(markdown_cache_dir), hashlib.blake2b(
+        body.encode('utf-8'), digest_size=16).hexdigest() + '.html')
+
+
+def recall_pandoc_html(body):
+    """
+    Returns the html pandoc made of markdown `body` before, in this run, or in
+    an earlier one when `markdown_cache_dir` is set.  None if there is none.
+    """
+
+    html = recall(pandoc_cache, body)
+    if html is not None or markdown_cache_dir is None:
+        return html
+    try:
+        with open(pandoc_cache_file(body), 'r', encoding='utf-8') as f:
+            html = f.read()
+    except OSError:
+        return None
+    remember(pandoc_cache, body, html)
+    return html
+
+
+def remember_pandoc_html(body, html):
+    """
+    Remembers the html pandoc made of markdown `body`, also on disk when
+    `markdown_cache_dir` is set, so that converting the same markdown in the
+    next run of a script does not start pandoc either.
+    """
+
+    remember(pandoc_cache, body, html)
+    if markdown_cache_dir is not None:
+        cache_file = pandoc_cache_file(body)
+        makedirs(dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            f.write(html)
 
 
 def upload_syllabus_from_markdown(course, markdown_body, access_token=None,
@@ -253,7 +1366,7 @@ def upload_syllabus_from_markdown(course, markdown_body, access_token=None,
         base: base url of canvas server
     """
 
-    return contact_server(requests.put, 'api/v1/courses/{}'.format(course),
+    return contact_server(session.put, f'api/v1/courses/{course}',
                           {'course[syllabus_body]':
                            convert_markdown(markdown_body, use_pandoc)
                            },
@@ -274,8 +1387,8 @@ def post_announcement_from_markdown(
         base: base url of canvas server
     """
 
-    return contact_server(requests.post,
-                          'api/v1/courses/{}/discussion_topics'.format(course),
+    return contact_server(session.post,
+                          f'api/v1/courses/{course}/discussion_topics',
                           {
                               'title': title,
                               'message': convert_markdown(markdown_body,
@@ -299,8 +1412,8 @@ def post_group_announcement_from_markdown(
         base: base url of canvas server
     """
 
-    return contact_server(requests.post,
-                          'api/v1/groups/{}/discussion_topics'.format(group),
+    return contact_server(session.post,
+                          f'api/v1/groups/{group}/discussion_topics',
                           {
                               'title': title,
                               'message':
@@ -343,30 +1456,28 @@ def create_discussion(
         base: base url of canvas server
     """
 
-    return contact_server(requests.post,
-                          'api/v1/courses/{}/discussion_topics'.format(course),
-                          dict([
-                              ('title', title),
-                              ('message',
-                               convert_markdown(markdown_message, use_pandoc)
-                               ),
-                              ('is_announcement', '0'),
-                              ('discussion_type', discussion_type),
-                              ('published', published),
-                              ('allow_rating', allow_rating),
-                              ('sort_by_rating', sort_by_rating),
-                              ('only_graders_can_rate', only_graders_can_rate),
-                              ('podcast_enabled', podcast_enabled),
-                              ('podcast_has_student_posts',
-                                  podcast_student_posts),
-                              ('require_initial_post', require_initial_post),
-                              ('pinned', pinned),
-                          ] +
-                              ([] if group is None else [('group', group)]) +
-                              ([] if position_after is None
-                               else [('position_after', position_after)])
-                          ),
-                          base, access_token)
+    data = {
+        'title': title,
+        'message': convert_markdown(markdown_message, use_pandoc),
+        'is_announcement': '0',
+        'discussion_type': discussion_type,
+        'published': int(bool(published)),
+        'allow_rating': int(bool(allow_rating)),
+        'sort_by_rating': int(bool(sort_by_rating)),
+        'only_graders_can_rate': int(bool(only_graders_can_rate)),
+        'podcast_enabled': int(bool(podcast_enabled)),
+        'podcast_has_student_posts': int(bool(podcast_student_posts)),
+        'require_initial_post': int(bool(require_initial_post)),
+        'pinned': int(bool(pinned)),
+    }
+    if group is not None:
+        data['group'] = group
+    if position_after is not None:
+        data['position_after'] = position_after
+
+    return contact_server(session.post,
+                          f'api/v1/courses/{course}/discussion_topics',
+                          data, base, access_token)
 
 
 def create_page_from_markdown(course, title, markdown_body, published=True,
@@ -383,8 +1494,8 @@ def create_page_from_markdown(course, title, markdown_body, published=True,
         base: base url of canvas server
     """
 
-    return contact_server(requests.post,
-                          'api/v1/courses/{}/pages'.format(course),
+    return contact_server(session.post,
+                          f'api/v1/courses/{course}/pages',
                           {
                               'wiki_page[title]': title,
                               'wiki_page[body]':
@@ -412,8 +1523,8 @@ def update_page_from_markdown(
         base: base url of canvas server
     """
 
-    return contact_server(requests.put,
-                          'api/v1/courses/{}/pages/{}'.format(course, url),
+    return contact_server(session.put,
+                          f'api/v1/courses/{course}/pages/{url}',
                           {
                               'wiki_page[title]': title,
                               'wiki_page[body]':
@@ -423,6 +1534,11 @@ def update_page_from_markdown(
                           base, access_token)
 
 
+list_assignment_groups = make_endpoint(
+    get_all_pages, 'api/v1/courses/{course}/assignment_groups',
+    {'include[]': 'assignments'})
+
+
 def get_assignment_groups(course, access_token=None, base=None):
     """
     Gets a list of all assignment groups for a course.
@@ -432,10 +1548,8 @@ def get_assignment_groups(course, access_token=None, base=None):
         base: base url of canvas server
     """
 
-    return contact_server(get_all_pages,
-                          'api/v1/courses/{}/assignment_groups'.format(course),
-                          {'include[]': 'assignments'},
-                          base, access_token)
+    return list_assignment_groups(base=base, access_token=access_token,
+                                  course=course)
 
 
 def create_assignment_group(course, name, position=None, group_weight=0,
@@ -453,16 +1567,13 @@ def create_assignment_group(course, name, position=None, group_weight=0,
     Currently does not allow setting grading rules. (TODO)
     """
 
-    return contact_server(requests.post,
-                          'api/v1/courses/{}/assignment_groups'.format(course),
-                          dict([
-                              ('name', name),
-                              ('group_weight', group_weight),
-                          ] +
-                              ([] if position is None
-                               else [('position', position)])
-                          ),
-                          base, access_token)
+    data = {'name': name, 'group_weight': group_weight}
+    if position is not None:
+        data['position'] = position
+
+    return contact_server(session.post,
+                          f'api/v1/courses/{course}/assignment_groups',
+                          data, base, access_token)
 
 
 def delete_assignment_group(course, group_id, move_assignments_to=None,
@@ -478,15 +1589,50 @@ def delete_assignment_group(course, group_id, move_assignments_to=None,
         base: base url of canvas server
     """
 
-    return contact_server(requests.delete,
-                          'api/v1/courses/{}/assignment_groups/{}'
-                          .format(course, group_id),
-                          dict([] if move_assignments_to is None
-                               else [('move_assignments_to',
-                                      move_assignments_to)]),
+    return contact_server(session.delete,
+                          f'api/v1/courses/{course}/assignment_groups/'
+                          f'{group_id}',
+                          {} if move_assignments_to is None
+                          else {'move_assignments_to': move_assignments_to},
                           base, access_token)
 
 
+def assignment_data(name, description, points, due_at, group_id,
+                    submission_types="on_paper", allowed_extensions=None,
+                    peer_reviews=False, auto_peer_reviews=False,
+                    ext_tool_url=None, ext_tool_new_tab=False):
+    """
+    Creates a dict with parameters for an assignment, to be posted by
+    `create_assignment` or `create_assignments_bulk`.  The parameters are the
+    same as for `create_assignment`, except that `description` is already
+    converted to html.
+    """
+
+    # The Canvas API documentation is wrong or at least misleading, submitting
+    # a hash for external_tool_assignment_tag causes internal server error. The
+    # fields have to he sent separately.
+
+    data = {
+        'assignment[name]': name,
+        'assignment[description]': description,
+        'assignment[submission_types]': submission_types,
+        'assignment[points_possible]': points,
+        'assignment[due_at]': due_at,
+        'assignment[assignment_group_id]': group_id,
+        'assignment[published]': 1,
+        'assignment[peer_reviews]': peer_reviews,
+        'assignment[automatic_peer_rewiews]': auto_peer_reviews,
+    }
+    if allowed_extensions is not None:
+        data['assignment[allowed_extensions]'] = allowed_extensions
+    if ext_tool_url is not None:
+        data['assignment[external_tool_tag_attributes][url]'] = ext_tool_url
+        data['assignment[external_tool_tag_attributes][new_tab]'] = \
+            ext_tool_new_tab
+
+    return data
+
+
 def create_assignment(course, name, markdown_description, points, due_at,
                       group_id, submission_types="on_paper",
                       allowed_extensions=None, peer_reviews=False,
@@ -517,40 +1663,50 @@ def create_assignment(course, name, markdown_description, points, due_at,
         base: base url of canvas server
     """
 
-    # The Canvas API documentation is wrong or at least misleading, submitting
-    # a hash for external_tool_assignment_tag causes internal server error. The
-    # fields have to he sent separately.
-
     return contact_server(
-        requests.post,
-        'api/v1/courses/{}/assignments'.format(course),
-        dict([
-            ('assignment[name]', name),
-            ('assignment[description]',
-             markdown.markdown(markdown_description,
-                               extensions=['extra'])),
-            ('assignment[submission_types]',
-             submission_types),
-            ('assignment[points_possible]',  points),
-            ('assignment[due_at]', due_at),
-            ('assignment[assignment_group_id]',  group_id),
-            ('assignment[published]', 1),
-            ('assignment[peer_reviews]', peer_reviews),
-            ('assignment[automatic_peer_rewiews]',
-             auto_peer_reviews)
-        ] +
-            ([] if allowed_extensions is None
-             else [('assignment[allowed_extensions]',
-                    allowed_extensions)]) +
-            ([] if ext_tool_url is None
-             else [('assignment[external_tool_tag_attributes][url]',
-                    ext_tool_url),
-                   ('assignment[external_tool_tag_attributes][new_tab]',
-                    ext_tool_new_tab)])
-        ),
+        session.post,
+        f'api/v1/courses/{course}/assignments',
+        assignment_data(name,
+                        convert_markdown(markdown_description, False),
+                        points, due_at, group_id, submission_types,
+                        allowed_extensions, peer_reviews, auto_peer_reviews,
+                        ext_tool_url, ext_tool_new_tab),
         base, access_token)
 
 
+def create_assignments_bulk(course, assignments, use_pandoc=False,
+                            access_token=None, base=None, workers=None):
+    """
+    Creates several assignments in the given course, converting all the
+    descriptions at once and posting the assignments concurrently.
+    Parameters:
+        course: a course ID, int or string
+        assignments: a list of dicts, each containing the keyword arguments
+            of `create_assignment` for one assignment (without `course`,
+            `access_token` and `base`)
+        use_pandoc: use Pandoc to convert markdown when available
+        access_token: access token
+        base: base url of canvas server
+        workers: number of assignments posted to the server at the same
+            time, defaults to the global `max_workers`
+    Returns a list of responses, one for each assignment, in order.
+    """
+
+    descriptions = convert_markdown_batch(
+        [item['markdown_description'] for item in assignments], use_pandoc)
+
+    bodies = []
+    for item, description in zip(assignments, descriptions):
+        fields = dict(item)
+        del fields['markdown_description']
+        bodies.append(assignment_data(description=description, **fields))
+
+    location = f'api/v1/courses/{course}/assignments'
+    return bulk([partial(contact_server, session.post, location, body,
+                         base, access_token)
+                 for body in bodies], workers)
+
+
 def course_settings_set(course, settings, access_token=None, base=None):
     """
     Set settings in a course.
@@ -562,14 +1718,25 @@ def course_settings_set(course, settings, access_token=None, base=None):
     """
 
     return contact_server(
-        requests.put,
-        'api/v1/courses/{}'.format(course),
+        session.put,
+        f'api/v1/courses/{course}',
         {
             "course[{}]".format(k): v for k, v in settings.items()
         },
         base, access_token)
 
 
+# The fields that are the same for every redirect tool, encoded only once.
+REDIRECT_TOOL_FIELDS = urlencode({
+    'privacy_level': 'Anonymous',
+    'consumer_key': 'N/A',
+    'shared_secret': 'hjkl',
+    'url': 'https://www.edu-apps.org/redirect',
+    'not_selectable': 1,
+    'course_navigation[enabled]': 1,
+})
+
+
 def create_redirect_tool(
         course, text, url, new_tab=False, default=True,
         access_token=None, base=None):
@@ -585,42 +1752,109 @@ def create_redirect_tool(
         base: base url of canvas server
     """
 
-    return contact_server(requests.post,
-                          'api/v1/courses/{}/external_tools'.format(course),
-                          {
+    return contact_server(session.post,
+                          f'api/v1/courses/{course}/external_tools',
+                          urlencode({
                               'name': 'Redirect to ' + text,
-                              'privacy_level': 'Anonymous',
-                              'consumer_key': 'N/A',
-                              'shared_secret': 'hjkl',
-                              'url': 'https://www.edu-apps.org/redirect',
                               'text': text,
                               'custom_fields[url]': url,
-                              'custom_fields[new_tab]': (1 if new_tab else 0),
-                              'not_selectable': True,
-                              'course_navigation[enabled]': True,
+                              'custom_fields[new_tab]': int(bool(new_tab)),
                               'course_navigation[text]': text,
-                              'course_navigation[default]': default,
+                              'course_navigation[default]':
+                                  int(bool(default)),
                               'description': "Redirects to " + url
-                          },
+                          }) + '&' + REDIRECT_TOOL_FIELDS,
                           base, access_token)
 
 
+list_course_files = make_endpoint(get_all_pages,
+                                  'api/v1/courses/{course}/files')
+
+
+list_folder_files = make_endpoint(get_all_pages,
+                                  'api/v1/folders/{folder}/files')
+
+
 def list_files(course, pattern, folder=None,
                access_token=None, base=None):
     """
     Lists files matching pattern
     Parameters:
         course: the course id
-        pattern: the pattern to match
-        folder: currently unused
+        pattern: the pattern to match.  Canvas matches a plain pattern
+            anywhere in the file name.  A pattern with shell style wildcards
+            (*, ? or [...]) is matched against whole file names.
+        folder: optional folder id, to only list files in that folder
+            instead of searching the whole course
         access_token: access token
         base: base url of canvas server
     """
 
-    return contact_server(get_all_pages,
-                          'api/v1/courses/{}/files'.format(course),
-                          {'search_term': pattern},
-                          base, access_token)
+    glob = GLOB.search(pattern) is not None
+    # Let the server narrow the listing down by the longest literal part of a
+    # glob, Canvas needs at least two characters.
+    search = max(GLOB.split(pattern), key=len) if glob else pattern
+    params = {'search_term': search} if len(search) >= 2 else {}
+
+    if folder is None:
+        files = list_course_files(params, base, access_token, course=course)
+    else:
+        files = list_folder_files(params, base, access_token, folder=folder)
+
+    if not glob:
+        return files
+    return [file for file in files
+            if fnmatchcase(file['display_name'], pattern)]
+
+
+def upload_size(local_file):
+    """
+    Size of a file about to be uploaded.  Canvas cannot finish the upload of
+    an empty file, so it is rejected before the upload starts rather than
+    after the server has already reserved a spot for it.
+    Parameters:
+        local_file: the local path to the file
+    Returns the size in bytes.  Raises ValueError if the file is empty.
+    """
+
+    size = getsize(local_file)
+    if size == 0:
+        raise ValueError(f"Cannot upload {local_file}: the file is empty")
+    return size
+
+
+def upload_to_url(upload_url, upload_params, local_file, content_type=None):
+    """
+    Second step of the Canvas file upload: post the file contents to the url
+    obtained from the server, together with the upload parameters.  When
+    requests_toolbelt is available, the file is streamed instead of being
+    read into memory as a whole.
+    Parameters:
+        upload_url: the upload url returned by the server
+        upload_params: a dict with upload parameters returned by the server
+        local_file: the local path to the file
+        content_type: mailcap style content type of the file
+    Returns the response of the upload request.  Raises CanvasHTTPError if the
+    upload fails.
+    """
+
+    with open(local_file, 'rb') as file:
+        if not HAS_TOOLBELT:
+            response = session.post(
+                upload_url, data=upload_params, files={'file': file})
+        else:
+            encoder = MultipartEncoder(fields=[
+                (key, str(value)) for key, value in upload_params.items()
+            ] + [
+                ('file', (basename(local_file), file,
+                          content_type or 'application/octet-stream'))
+            ])
+            response = session.post(
+                upload_url, data=encoder,
+                headers={'Content-Type': encoder.content_type})
+
+    raise_for_canvas(response)
+    return response
 
 
 def upload_file_to_course(course, local_file, upload_path, remote_name=None,
@@ -630,8 +1864,9 @@ def upload_file_to_course(course, local_file, upload_path, remote_name=None,
     Upload a file to the course 'files'.
     Parameters:
         course: the course id
-        local_file: the local path to the file.  The file must exist, and not
-            be huge
+        local_file: the local path to the file.  The file must exist and
+            must not be empty.  It is streamed to the server when
+            requests_toolbelt is available
         upload_path: the remote directory the file goes to.  It will be created
             if it does not exist
         remote_name: the file name to use on the server. When unspecified, it
@@ -642,30 +1877,55 @@ def upload_file_to_course(course, local_file, upload_path, remote_name=None,
             under a modified name
         access_token: access token
         base: base url of canvas server
+    Raises ValueError, before anything is sent, if `local_file` is empty.
     """
 
+    data = {
+        'name': remote_name if remote_name is not None
+        else basename(local_file),
+        'size': upload_size(local_file),
+        'parent_folder_path': upload_path,
+        'on_duplicate': 'overwrite' if overwrite else 'rename',
+    }
+    if content_type is not None:
+        data['content_type'] = content_type
+
     response = contact_server(
-        requests.post,
-        'api/v1/courses/{}/files'.format(course),
-        data=dict(
-            [
-                ('name', remote_name if remote_name is not None
-                 else basename(local_file)),
-                ('size', getsize(local_file)),
-                ('parent_folder_path', upload_path),
-                ('on_duplicate', 'overwrite' if overwrite
-                 else 'rename')
-            ] + ([('content_type', content_type)]
-                 if content_type is not None else [])),
+        session.post,
+        f'api/v1/courses/{course}/files',
+        data=data,
         base=base, access_token=access_token)
-    response.raise_for_status()
+    raise_for_canvas(response)
 
-    upload_url = response.json()["upload_url"]
-    upload_params = response.json()["upload_params"]
+    info = decode_json(response)
 
-    with open(local_file, 'rb') as file:
-        return requests.post(
-            upload_url, data=upload_params, files={'file': file})
+    return upload_to_url(info["upload_url"], info["upload_params"],
+                         local_file, content_type)
+
+
+def upload_files_bulk(course, local_files, upload_path, overwrite=False,
+                      access_token=None, base=None, workers=None):
+    """
+    Upload several files to the course 'files', concurrently.  Each file goes
+    through both steps of `upload_file_to_course`, and while one file waits
+    for the server, the others keep going.
+    Parameters:
+        course: the course id
+        local_files: a list of local paths to the files
+        upload_path: the remote directory the files go to
+        overwrite: if True, overwrite existing files.  Otherwise upload files
+            under modified names
+        access_token: access token
+        base: base url of canvas server
+        workers: number of files uploaded at the same time, defaults to the
+            global `max_workers`
+    Returns a list of responses of the uploads, one for each file, in order.
+    """
+
+    return bulk([partial(upload_file_to_course, course, local_file,
+                         upload_path, overwrite=overwrite,
+                         access_token=access_token, base=base)
+                 for local_file in local_files], workers)
 
 
 def import_qti_quiz(course, qti_file, access_token=None, base=None):
@@ -685,31 +1945,28 @@ def import_qti_quiz(course, qti_file, access_token=None, base=None):
         Response with the migration info
     """
 
-    response = contact_server(requests.post,
-                              'api/v1/courses/{}/content_migrations'.format(
-                                  course),
+    response = contact_server(session.post,
+                              f'api/v1/courses/{course}/content_migrations',
                               data=dict(
                                   [
                                       ('migration_type', 'qti_converter'),
                                       ('pre_attachment[name]',
                                        basename(qti_file)),
                                       ('pre_attachment[size]',
-                                       getsize(qti_file))
+                                       upload_size(qti_file))
                                   ]),
                               base=base, access_token=access_token)
-    response.raise_for_status()
+    raise_for_canvas(response)
 
-    upload_url = response.json()['pre_attachment']['upload_url']
-    upload_params = response.json()['pre_attachment']['upload_params']
-    migration_id = response.json()['id']
+    info = decode_json(response)
 
-    with open(qti_file, 'rb') as file:
-        requests.post(upload_url, data=upload_params, files={'file': file})
+    upload_to_url(info['pre_attachment']['upload_url'],
+                  info['pre_attachment']['upload_params'], qti_file)
 
-    return contact_server(requests.get,
-                          "/api/v1/courses/{}/content_migrations/{}".format(
-                              course, migration_id
-                          ))
+    return contact_server(session.get,
+                          f"/api/v1/courses/{course}/content_migrations/"
+                          f"{info['id']}",
+                          None, base, access_token)
 
 
 def get_list_of_courses(access_token=None, base=None):
@@ -735,11 +1992,33 @@ def get_students(course, base=None, access_token=None):
     """
 
     return contact_server(get_all_pages,
-                          'api/v1/courses/{}/users'.format(course),
+                          f'api/v1/courses/{course}/users',
                           {'enrollment_type': 'student'},
                           base, access_token)
 
 
+def get_students_with_logins(course, base=None, access_token=None):
+    """Lists all students in a given course, with their emails and
+    enrollments, in a single listing.
+    Parameters:
+        course: course ID
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+    Returns a dict of dicts, one for each student, by their sis_login_id.
+    Students whose login id is not visible are left out.
+    """
+
+    students = {student['login_id']: student
+                for student in contact_server(
+                    get_all_pages,
+                    f'api/v1/courses/{course}/users',
+                    {'enrollment_type': 'student',
+                     'include[]': ['email', 'enrollments']},
+                    base, access_token)
+                if student.get('login_id') is not None}
+    return students
+
+
 def find_user_by_login_id(login_id, base=None, access_token=None):
     """Search for a user with a given sis_login_id, if found, return user
     profile.
@@ -750,13 +2029,114 @@ def find_user_by_login_id(login_id, base=None, access_token=None):
     Returns a request result
     """
 
-    return contact_server(requests.get,
-                          "/api/v1/users/sis_login_id:{}/profile".format(
-                              login_id),
-                          base, access_token)
+    return contact_server(session.get,
+                          f"/api/v1/users/sis_login_id:{login_id}/profile",
+                          None, base, access_token)
+
+
+@contextmanager
+def open_user_cache(flag='c'):
+    """
+    Opens the shelf remembering user ids, see `user_cache_file`, for use in a
+    `with` statement.  A shelf can not be used from several threads at once,
+    so `user_cache_lock` is held until the shelf is closed.  When
+    `user_cache_file` is None, an empty dict stands in for the shelf, and
+    nothing is remembered.
+    """
+    with user_cache_lock:
+        if user_cache_file is None:
+            yield {}
+            return
+        file = expanduser(user_cache_file)
+        makedirs(dirname(file), exist_ok=True)
+        with shelve.open(file, flag) as cache:
+            yield cache
+
+
+def cached_user_id(login_id, base=None):
+    """
+    Returns the remembered Canvas user id for a sis_login_id, or None if it
+    is not known or too old.
+    """
+    key = '{}|{}'.format(base_url if base is None else base, login_id)
+    with open_user_cache() as cache:
+        entry = cache.get(key)
+    if entry is None or entry[0] < time.time():
+        return None
+    return entry[1]
+
 
+def remember_user_id(login_id, user_id, base=None):
+    "Remembers the Canvas user id for a sis_login_id for `user_cache_ttl`."
+    remember_user_ids({login_id: user_id}, base)
 
-def enroll_user_by_login_id(course, login_id, base=None, access_token=None):
+
+def remember_user_ids(user_ids, base=None):
+    """
+    Remembers Canvas user ids given as a dict in the form
+    {sis_login_id: user_id} for `user_cache_ttl`.
+    """
+    expires = time.time() + user_cache_ttl
+    base = base_url if base is None else base
+    with open_user_cache() as cache:
+        for login_id, user_id in user_ids.items():
+            cache['{}|{}'.format(base, login_id)] = (expires, user_id)
+
+
+def purge_user_cache():
+    "Forgets all remembered user ids."
+    with open_user_cache('n'):
+        pass
+
+
+def resolve_login_ids(login_ids, course=None, base=None, access_token=None,
+                      workers=None):
+    """
+    Finds the Canvas user ids of many users by their sis_login_id at once.
+    Remembered ids are taken first, then, if `course` is given, one listing of
+    its students, and only the rest is looked up one user at a time,
+    concurrently.  The ids found are remembered between runs.
+    Parameters:
+        login_ids: an iterable of sis_login_ids
+        course: optional course ID, whose students are listed first
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        workers: number of users looked up at the same time, defaults to the
+            global `max_workers`
+    Returns a dict in the form {sis_login_id: user_id}.  Users that were not
+    found are left out.
+    """
+
+    login_ids = list(dict.fromkeys(login_ids))
+    prefix = '{}|'.format(base_url if base is None else base)
+    now = time.time()
+    with open_user_cache() as cache:
+        entries = {login_id: cache.get(prefix + login_id)
+                   for login_id in login_ids}
+    user_ids = {login_id: entry[1] for login_id, entry in entries.items()
+                if entry is not None and entry[0] >= now}
+
+    missing = [login_id for login_id in login_ids if login_id not in user_ids]
+    found = {}
+    if missing and course is not None:
+        students = get_students_with_logins(course, base, access_token)
+        found.update((login_id, students[login_id]['id'])
+                     for login_id in missing if login_id in students)
+        missing = [login_id for login_id in missing if login_id not in found]
+
+    for login_id, resp in zip(missing, bulk(
+            [partial(find_user_by_login_id, login_id, base, access_token)
+             for login_id in missing], workers)):
+        if resp.ok:
+            found[login_id] = decode_json(resp)['id']
+    if found:
+        remember_user_ids(found, base)
+    user_ids.update(found)
+    return user_ids
+
+
+def enroll_user_by_login_id(course, login_id, base=None, access_token=None,
+                            user_cache=None):
     """Enrolls a user with a given sis_login_id, if found. Returns user
     profile.
     Parameters:
@@ -764,39 +2144,68 @@ def enroll_user_by_login_id(course, login_id, base=None, access_token=None):
         login_id: user's sis_login_id
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
+        user_cache: optional dict of users by their sis_login_id, as returned
+            by `get_students_with_logins`, to take the user id from
     Returns a request result
     """
 
-    resp = find_user_by_login_id(login_id, base, access_token)
+    enrollments = f'api/v1/courses/{course}/enrollments'
 
-    if resp.status_code != 200:
-        return resp
+    def enroll(user_id):
+        return contact_server(session.post, enrollments,
+                              {'enrollment[user_id]': user_id,
+                               'enrollment[enrollment_state]': 'active'},
+                              base, access_token)
 
-    json = resp.json()
+    if user_cache is not None and login_id in user_cache:
+        return enroll(user_cache[login_id]['id'])
 
-    if "login_id" in json and json["login_id"] == login_id and "id" in json:
-        id = resp.json()['id']
-    else:
-        return resp
+    # Canvas resolves the sis_login_id: reference itself, which saves looking
+    # the user up first.
+    return enroll('sis_login_id:{}'.format(login_id))
 
-    return contact_server(requests.post,
-                          'api/v1/courses/{}/enrollments'.format(course),
-                          {'enrollment[user_id]': id,
-                           'enrollment[enrollment_state]': 'active'},
-                          base, access_token)
+
+def enroll_users_by_login_id(course, login_ids, base=None, access_token=None,
+                             workers=None):
+    """Enrolls a roster of users given by their sis_login_ids, concurrently.
+    Each user is enrolled with `enroll_user_by_login_id`, in a single
+    request.  The user ids of the enrolled users are remembered between runs,
+    see `user_cache_file`.
+    Parameters:
+        course: course ID
+        login_ids: an iterable of sis_login_ids
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        workers: number of users enrolled at the same time, defaults to the
+            global `max_workers`
+    Returns a dict of request results by sis_login_id
+    """
+
+    login_ids = list(dict.fromkeys(login_ids))
+    results = dict(zip(login_ids, bulk(
+        [partial(enroll_user_by_login_id, course, login_id, base,
+                 access_token) for login_id in login_ids], workers)))
+    # Remembered in one write, after the workers are done.
+    enrolled = {login_id: decode_json(resp)['user_id']
+                for login_id, resp in results.items() if resp.ok}
+    if enrolled:
+        remember_user_ids(enrolled, base)
+    return results
 
 
-def get_enrollments(course, base=None, access_token=None):
+def get_enrollments(course, base=None, access_token=None, iterate=False):
     """Lists all enrollments in a given course.
     Parameters:
         course: course ID
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
+        iterate: if true, return an iterator that yields the enrollments one
+            at a time as they are downloaded, instead of a list.
     Returns a list of dicts, one for each enrollment
     """
 
-    return contact_server(get_all_pages,
-                          'api/v1/courses/{}/enrollments'.format(course),
+    return contact_server(iter_streamed_pages if iterate else get_all_pages,
+                          f'api/v1/courses/{course}/enrollments',
                           {},
                           base, access_token)
 
@@ -814,9 +2223,8 @@ def enrollment_stop(
     Returns a request result
     """
 
-    return contact_server(requests.delete,
-                          'api/v1/courses/{}/enrollments/{}'.format(
-                              course, user_id),
+    return contact_server(session.delete,
+                          f'api/v1/courses/{course}/enrollments/{user_id}',
                           {"task": task},
                           base, access_token)
 
@@ -845,29 +2253,25 @@ def create_appointment_group(course_list, title, description, location,
         private: participants cannot see each others names
     """
 
-    return contact_server(
-        requests.post, "/api/v1/appointment_groups",
-        dict([
-            ('appointment_group[context_codes][]',
-             ['course_{}'.format(id) for id in course_list]),
-            ('appointment_group[title]', title),
-            ('appointment_group[description]', description),
-            ('appointment_group[location_name]', location),
-            ('appointment_group[participants_per_appointment]',
-             max_part),
-            ('appointment_group[max_appointments_per_participant]',
-             max_per_part),
-            ('appointment_group[min_appointments_per_participant]',
-             min_per_part),
-            ('appointment_group[participant_visibility]',
-             'private' if private else 'protected'),
-            ('appointment_group[publish]', publish)] +
-            [('appointment_group[new_appointments][{}][]'.format(i+1),
-              slot) for i, slot in enumerate(time_slots)]
-        ),
-        base, access_token)
+    params = form_data(
+        'appointment_group',
+        context_codes=list(map(course, course_list)),
+        title=title,
+        description=description,
+        location_name=location,
+        participants_per_appointment=max_part,
+        max_appointments_per_participant=max_per_part,
+        min_appointments_per_participant=min_per_part,
+        participant_visibility='private' if private else 'protected',
+        publish=publish,
+        new_appointments={str(i): slot
+                          for i, slot in enumerate(time_slots, 1)})
+
+    return contact_server(session.post, "/api/v1/appointment_groups",
+                          params, base, access_token)
 
 
+@ttl_cache(3600)
 def get_group_categories(course, base=None, access_token=None):
     """Lists all group categories in a given course.
     Parameters:
@@ -877,15 +2281,41 @@ def get_group_categories(course, base=None, access_token=None):
     Returns a list of dicts, one for each category
     """
 
-    return contact_server(get_all_pages,
-                          'api/v1/courses/{}/group_categories'.format(course),
-                          base, access_token)
+    return contact_server(get_all_pages,
+                          f'api/v1/courses/{course}/group_categories',
+                          None, base, access_token)
+
+
+def groups_location(course, category=None):
+    "The api location of the groups of a course or of a group category."
+    if category is None:
+        return f'api/v1/courses/{course}/groups'
+    return f'api/v1/group_categories/{category}/groups'
+
+
+def get_groups(course, category=None, base=None, access_token=None):
+    """
+    Lists groups in a course.  If category ID is given, only list the groups
+    in this category.  Note that in that case, course id is ignored.
+
+    Parameters:
+        course: course ID
+        category: optional string or int, an ID of a group category.
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+    Returns a list of dicts, one for each group.
+    """
+
+    return contact_server(get_all_pages, groups_location(course, category),
+                          None, base, access_token)
 
 
-def get_groups(course, category=None, base=None, access_token=None):
+def get_groups_with_members(course, category=None, base=None,
+                            access_token=None):
     """
-    Lists groups in a course.  If category ID is given, only list the groups
-    in this category.  Note that in that case, course id is ignored.
+    Same as `get_groups`, but each group also has a "users" key with the list
+    of its members, all in the same listing, instead of calling
+    `get_group_members` for every group.
 
     Parameters:
         course: course ID
@@ -895,14 +2325,8 @@ def get_groups(course, category=None, base=None, access_token=None):
     Returns a list of dicts, one for each group.
     """
 
-    if category is None:
-        api = 'api/v1/courses/{}/groups'.format(course)
-    else:
-        api = 'api/v1/group_categories/{}/groups'.format(category)
-
-    return contact_server(get_all_pages,
-                          api,
-                          base, access_token)
+    return contact_server(get_all_pages, groups_location(course, category),
+                          {'include[]': ['users']}, base, access_token)
 
 
 def get_group_members(group, base=None, access_token=None):
@@ -919,10 +2343,11 @@ def get_group_members(group, base=None, access_token=None):
     """
 
     return contact_server(get_all_pages,
-                          "/api/v1/groups/{}/users".format(group),
-                          base, access_token)
+                          f"/api/v1/groups/{group}/users",
+                          None, base, access_token)
 
 
+@stale_while_revalidate()
 def get_assignments(course, search=None, bucket=None, base=None,
                     access_token=None):
     """
@@ -942,17 +2367,33 @@ def get_assignments(course, search=None, bucket=None, base=None,
         list of assignments
     """
 
-    return contact_server(
-        get_all_pages,
-        "/api/v1/courses/{}/assignments".format(course),
-        None if (search is None and bucket is None) else
-        dict(([] if search is None else [('search_term', search)]) +
-             ([] if bucket is None else [('bucket', bucket)])),
-        base, access_token)
+    return contact_server(get_all_pages,
+                          f"/api/v1/courses/{course}/assignments",
+                          compact_params({'search_term': search,
+                                          'bucket': bucket}),
+                          base, access_token)
+
+
+SUBMISSION_URL = \
+    "/api/v1/courses/{course}/assignments/{assignment}/submissions/{student}"
+
+
+def submission_urls(course, assignment_id, student_ids):
+    """
+    Returns a list of the locations of the submissions of `student_ids` for
+    an assignment, for callers that send a request for each of them, for
+    example with `bulk` or `make_async`.
+    """
+
+    fields = {"course": course, "assignment": assignment_id}
+    return [SUBMISSION_URL.format_map(dict(fields, student=student))
+            for student in student_ids]
 
 
+@stale_while_revalidate()
 def get_submissions(course, assignment=None, student=None, assignments=None,
-                    students=None, grouped=True, base=None, access_token=None):
+                    students=None, grouped=True, iterate=False, base=None,
+                    access_token=None):
     """
     Get assignment(s) submission(s) from the course.
 
@@ -964,45 +2405,77 @@ def get_submissions(course, assignment=None, student=None, assignments=None,
         assignments: a list of assignment ids.  If both assignment and
             assignments are None, obtain all assignments
         students: a list of student ids. If both student and students are None,
-            obtain assignments for all students
+            obtain assignments for all students.  The list is not modified.
         grouped: If multiple assignments for multiple students are to be
             listed, should they be grouped by students?  Otherwise ignored.
+        iterate: if true, return an iterator that yields the submissions one
+            at a time as they are downloaded, instead of a list.  Useful for
+            huge courses, especially when ijson is available.
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
 
-    Returns a list of submissions.
+    Returns a list of submissions, or a single submission when both
+    `assignment` and `student` are given.
     """
 
+    if student is not None and assignment is not None:
+        # A single submission, not a paginated list.
+        return contact_server(
+            get_json,
+            SUBMISSION_URL.format(course=course, assignment=assignment,
+                                  student=student),
+            None, base, access_token)
+
+    # Build new lists, so that the caller's lists are never modified, and
+    # drop repeated ids.
+    if student is not None:
+        students = list(dict.fromkeys([*(students or []), student]))
+    elif students is not None:
+        students = list(dict.fromkeys(students))
+    if assignments is not None:
+        assignments = list(dict.fromkeys(assignments))
+
     data = None
-    if student is None:
-        if assignment is None:
-            data = dict(
-                [('student_ids[]',
-                  "all" if students is None else ','.join(str(id) for id
-                                                          in students))] +
-                ([] if assignments is None else ['assignments_ids[]',
-                                                 ','.join(str(id) for id in
-                                                          assignments)]) +
-                [('grouped', 1 if grouped else 0)])
-            api = "/api/v1/courses/{}/students/submissions".format(course)
-        else:
-            api = "/api/v1/courses/{}/assignments/{}/submissions".format(
-                course, assignment)
+    if assignment is None:
+        data = {'student_ids[]': "all" if students is None else students,
+                'grouped': int(bool(grouped))}
+        if assignments is not None:
+            data['assignment_ids[]'] = assignments
+        api = f"/api/v1/courses/{course}/students/submissions"
     else:
-        api = "/api/v1/courses/{}/assignments/{}/submissions/{}".format(
-            course, assignment, student)
+        api = f"/api/v1/courses/{course}/assignments/{assignment}/submissions"
 
-    return contact_server(get_all_pages, api, data, base, access_token)
+    return contact_server(iter_streamed_pages if iterate else get_all_pages,
+                          api, data, base, access_token)
 
 
-def create_grade_data(grades, assignment_id=None):
+def create_grade_data(grades, assignment_id=None, comments=None):
     """
     A help function that takes an assignment id and a dict of student
     grades in the form {student_id: grade} and converts it into a dict
     suitable for submission to Canvas server.
+
+    Grades for several assignments can be given as a nested dict in the form
+    {assignment_id: {student_id: grade}}, with `assignment_id` left out.
+
+    Optional `comments` in the form {student_id: comment} (or nested the same
+    way as the grades) are added to the same data, so students can be
+    commented on without being graded.
     """
 
+    if comments is None:
+        comments = {}
+
+    if assignment_id is None and grades and all(
+            isinstance(grade, dict) for grade in grades.values()):
+        return {"grade_data": {
+            id: create_grade_data(assignment_grades,
+                                  comments=comments.get(id))["grade_data"]
+            for id, assignment_grades in grades.items()}}
+
     grade_dict = {id: {"posted_grade": grade} for id, grade in grades.items()}
+    for id, comment in comments.items():
+        grade_dict.setdefault(id, {})["text_comment"] = comment
 
     if assignment_id is None:
         return {"grade_data": grade_dict}
@@ -1010,10 +2483,55 @@ def create_grade_data(grades, assignment_id=None):
         return {"grade_data": {assignment_id: grade_dict}}
 
 
-def update_grades(course, assignment_id, grades, base=None, access_token=None):
+def form_fields(data, prefix=None, fields=None):
+    """
+    Flattens a nested dict into form fields the way Canvas expects them, so
+    that {'a': {'b': 1}} becomes [('a[b]', 1)].  The fields are collected
+    into a single list of pairs, which `contact_server` encodes in one go,
+    instead of merging a dict for every level of nesting.
+    """
+
+    if fields is None:
+        fields = []
+    for key, value in data.items():
+        name = str(key) if prefix is None else '{}[{}]'.format(prefix, key)
+        if isinstance(value, dict):
+            form_fields(value, name, fields)
+        else:
+            fields.append((name, value))
+    return fields
+
+
+def update_grades_bulk(course, grade_map, base=None, access_token=None,
+                       comments=None):
+    """
+    Submit grades for several assignments and students, all in one request.
+
+    Parameters:
+        course: the course ID
+        grade_map: a dict of dicts with grades in the form
+            {assignment_id: {student_id: grade}}
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        comments: optional dict of dicts with comments in the form
+            {assignment_id: {student_id: comment}}, submitted together with
+            the grades
+
+    Returns a response with a progress object for the update.
+    """
+
+    return contact_server(
+        session.post,
+        f"/api/v1/courses/{course}/submissions/update_grades",
+        form_fields(create_grade_data(grade_map, comments=comments)),
+        base, access_token)
+
+
+def update_grades(course, assignment_id, grades, base=None, access_token=None,
+                  comments=None):
     """
-    Submit grades for an assignment. WARNING: This does not seem to work,
-    I keep getting an internal server error from it.
+    Submit grades for an assignment, all in one request.  To submit grades
+    for several assignments in one request, use `update_grades_bulk`.
 
     Parameters:
         course: the course ID
@@ -1021,24 +2539,22 @@ def update_grades(course, assignment_id, grades, base=None, access_token=None):
         grades: a dict with student grade in the form {student_id: grade}
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
+        comments: optional dict with comments in the form
+            {student_id: comment}, submitted together with the grades
 
     Returns something, hopefully
     """
 
-    data = create_grade_data(grades)
-
-    return contact_server(
-        requests.post,
-        "/api/v1/courses/{}/assignments/{}/submissions/update_grades".format(
-            course, assignment_id),
-        data,
-        base, access_token)
+    return update_grades_bulk(
+        course, {assignment_id: grades}, base, access_token,
+        comments=None if comments is None else {assignment_id: comments})
 
 
 def update_grade(course, assignment_id, student_id, grade, base=None,
                  access_token=None):
     """
-    Submit a single grade for an assignment.
+    Submit a single grade for an assignment.  When grading many students,
+    `update_grades` or `update_grades_bulk` do it in a single request.
 
     Parameters:
         course: the course ID
@@ -1053,9 +2569,9 @@ def update_grade(course, assignment_id, student_id, grade, base=None,
     """
 
     return contact_server(
-        requests.put,
-        "/api/v1/courses/{}/assignments/{}/submissions/{}".format(
-            course, assignment_id, student_id),
+        session.put,
+        SUBMISSION_URL.format(course=course, assignment=assignment_id,
+                              student=student_id),
         {"submission[posted_grade]": grade},
         base, access_token)
 
@@ -1063,7 +2579,8 @@ def update_grade(course, assignment_id, student_id, grade, base=None,
 def comment_on_submission(course, assignment_id, student_id, comment,
                           base=None, access_token=None):
     """
-    Submit a comment on a submission.
+    Submit a comment on a submission.  When commenting on many students,
+    `bulk_comment` does it in a single request.
 
     Parameters:
         course: the course ID
@@ -1077,13 +2594,81 @@ def comment_on_submission(course, assignment_id, student_id, comment,
     """
 
     return contact_server(
-        requests.put,
-        "/api/v1/courses/{}/assignments/{}/submissions/{}".format(
-            course, assignment_id, student_id),
+        session.put,
+        SUBMISSION_URL.format(course=course, assignment=assignment_id,
+                              student=student_id),
         {"comment[text_comment]": comment},
         base, access_token)
 
 
+def bulk_comment(course, assignment_id, comments, base=None,
+                 access_token=None):
+    """
+    Submit comments on submissions of many students, all in one request,
+    instead of calling `comment_on_submission` for each of them.
+
+    Parameters:
+        course: the course ID
+        assignment_id: the ID of the assignment
+        comments: a dict with comments in the form {student_id: comment}
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+
+    Returns a response with a progress object for the update.
+    """
+
+    return update_grades(course, assignment_id, {}, base, access_token,
+                         comments=comments)
+
+
+def update_grades_parallel(course, assignment_id, grades, base=None,
+                           access_token=None, workers=None):
+    """
+    Submit grades for an assignment with one `update_grade` request for each
+    student, sent concurrently.  Unlike `update_grades`, whose progress
+    object has to be polled, each grade is saved when its response arrives.
+
+    Parameters:
+        course: the course ID
+        assignment_id: the ID of the assignment
+        grades: a dict with student grade in the form {student_id: grade}
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        workers: number of grades submitted at the same time, defaults to
+            the global `max_workers`
+
+    Returns a list of responses, one for each student, in order.
+    """
+
+    return bulk([partial(update_grade, course, assignment_id, student, grade,
+                         base, access_token)
+                 for student, grade in grades.items()], workers)
+
+
+def comment_on_submission_parallel(course, assignment_id, comments,
+                                   base=None, access_token=None,
+                                   workers=None):
+    """
+    Submit comments on submissions with one `comment_on_submission` request
+    for each student, sent concurrently.
+
+    Parameters:
+        course: the course ID
+        assignment_id: the ID of the assignment
+        comments: a dict with comments in the form {student_id: comment}
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        workers: number of comments submitted at the same time, defaults to
+            the global `max_workers`
+
+    Returns a list of responses, one for each student, in order.
+    """
+
+    return bulk([partial(comment_on_submission, course, assignment_id,
+                         student, comment, base, access_token)
+                 for student, comment in comments.items()], workers)
+
+
 # This is really pretty much useless.  The custom columns are not shown to
 # students, they are only for some sort of teacher notes to themselves. Don't
 # see the point. I added this because I was hoping that I will be able to add
@@ -1107,12 +2692,10 @@ def create_gradebook_column(course, title, position=0, hidden=False,
     """
 
     return contact_server(
-        requests.post,
-        "/api/v1/courses/{}/custom_gradebook_columns".format(course),
-        dict([('column[title]', title),
-              ('column[position]', position),
-              ('column[hidden]', 1 if hidden else 0),
-              ('column[read_only]', 1 if read_only else 0)]),
+        session.post,
+        f"/api/v1/courses/{course}/custom_gradebook_columns",
+        form_data('column', title=title, position=position,
+                  hidden=bool(hidden), read_only=bool(read_only)),
         base, access_token)
 
 
@@ -1121,7 +2704,7 @@ def course(course):
     Utility function that takes a course id and prefixes it with 'course_'.
     """
 
-    return f"course_{course}"
+    return context_code(course)
 
 
 def group(group):
@@ -1156,18 +2739,13 @@ def create_conversation(recipients, subject, body, force_new=False,
     Returns something, hopefully
     """
 
-    return contact_server(
-        requests.post,
-        "/api/v1/conversations",
-        dict([('recipients[]', recipients),
-              ('subject', subject),
-              ('body', body),
-              ('scope', 'unread'),
-              ('force_new', 1 if force_new else 0),
-              ('group_conversation', 1 if is_group_conversation else 0)] +
-             ([] if context is None else [('context_code', context)])
-             ),
-        base, access_token)
+    params = form_data(recipients=recipients, subject=subject,
+                       body=body, scope='unread', force_new=bool(force_new),
+                       group_conversation=bool(is_group_conversation),
+                       context_code=context)
+
+    return contact_server(session.post, "/api/v1/conversations",
+                          params, base, access_token)
 
 
 def get_quiz_submissions(course, quiz_id, base=None, access_token=None):
@@ -1183,10 +2761,10 @@ def get_quiz_submissions(course, quiz_id, base=None, access_token=None):
     Returns a list of submissions for the quiz
     """
 
-    return contact_server(requests.get,
-                          "/api/v1/courses/{}/quizzes/{}/submissions".format(
-                              course, quiz_id),
-                          base, access_token)
+    return contact_server(session.get,
+                          f"/api/v1/courses/{course}/quizzes/{quiz_id}"
+                          "/submissions",
+                          None, base, access_token)
 
 
 def get_quiz_submission_answers(submission_id, base=None, access_token=None):
@@ -1202,12 +2780,13 @@ def get_quiz_submission_answers(submission_id, base=None, access_token=None):
     Returns a list of answers for the particular submission.
     """
 
-    return contact_server(requests.get,
-                          "/api/v1/quiz_submissions/{}/questions".format(
-                              submission_id),
-                          base, access_token)
+    return contact_server(session.get,
+                          f"/api/v1/quiz_submissions/{submission_id}"
+                          "/questions",
+                          None, base, access_token)
 
 
+@ttl_cache(3600)
 def get_favorite_courses(base=None, access_token=None):
     """
     Get current users list of favorite courses.
@@ -1219,46 +2798,107 @@ def get_favorite_courses(base=None, access_token=None):
 
     return contact_server(get_all_pages,
                           "/api/v1/users/self/favorites/courses",
-                          base, access_token)
+                          None, base, access_token)
+
+
+def favorite_course_ids(base=None, access_token=None):
+    """
+    Returns a set with ids (as strings) of the current users favorite courses.
+    The set is remembered for `cache_ttl` seconds, and kept up to date by
+    `add_course_to_favorites` and `remove_course_from_favorites`.  Like the
+    other caches, it is forgotten by `clear_cache`.
+    """
+    ids = remembered_favorite_course_ids(base, access_token)
+    if ids is None:
+        ids = {str(favorite['id'])
+               for favorite in get_favorite_courses(base, access_token)}
+        remember_favorite_course_ids(ids, base, access_token)
+    return ids
+
+
+def favorites_key(base=None, access_token=None):
+    "The key of the favorite courses of a user in `favorite_cache`."
+    return (base_url if base is None else base,
+            default_token() if access_token is None else access_token)
+
+
+def remembered_favorite_course_ids(base=None, access_token=None):
+    """
+    Returns the remembered set of favorite course ids, or None if there is
+    none, or it is too old.  Always None when `cache_ttl` is 0.
+    """
+    if cache_ttl <= 0:
+        return None
+    cached = recall(favorite_cache, favorites_key(base, access_token))
+    if cached is None or cached[0] <= time.monotonic():
+        return None
+    return cached[1]
+
+
+def remember_favorite_course_ids(ids, base=None, access_token=None):
+    "Remembers the set of favorite course `ids` for `cache_ttl` seconds."
+    if cache_ttl > 0:
+        remember(favorite_cache, favorites_key(base, access_token),
+                 (time.monotonic() + cache_ttl, frozenset(ids)))
 
 
 def add_course_to_favorites(course, base=None, access_token=None):
     """
     Add a course to the current users list of favorite courses.  If the course
-    already is a favorite, nothing happens.
+    already is a favorite, nothing happens.  When the favorite courses are
+    remembered (see `favorite_course_ids`) and the course is among them, no
+    request is sent.  The listing itself is never fetched here: when a user
+    has no favorites, Canvas lists the dashboard courses in their place.
 
     Parameters:
         course: a course id, string or integer
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
 
-    Returns a favorite.
+    Returns a favorite, or None if no request was sent.
     """
 
-    return contact_server(requests.post,
-                          "/api/v1/users/self/favorites/courses/{}".format(
-                              course),
-                          base, access_token)
+    ids = remembered_favorite_course_ids(base, access_token)
+    if ids is not None and str(course) in ids:
+        return None
+
+    resp = contact_server(session.post,
+                          f"/api/v1/users/self/favorites/courses/{course}",
+                          None, base, access_token)
+    if resp.ok and ids is not None:
+        # The request cleared the caches, remember the updated set again.
+        remember_favorite_course_ids(ids | {str(course)}, base, access_token)
+    return resp
 
 
 def remove_course_from_favorites(course, base=None, access_token=None):
     """
-    Removes a course from the current users list of favorite courses.
+    Removes a course from the current users list of favorite courses.  When
+    the favorite courses are remembered (see `favorite_course_ids`) and the
+    course is not among them, no request is sent.
 
     Parameters:
         course: a course id, string or integer
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
 
-    Returns a favorite.
+    Returns a favorite, or None if no request was sent.
     """
 
-    return contact_server(requests.delete,
-                          "/api/v1/users/self/favorites/courses/{}".format(
-                              course),
-                          base, access_token)
+    ids = remembered_favorite_course_ids(base, access_token)
+    if ids is not None and str(course) not in ids:
+        return None
+
+    resp = contact_server(session.delete,
+                          f"/api/v1/users/self/favorites/courses/{course}",
+                          None, base, access_token)
+    if resp.ok and ids is not None:
+        # The request cleared the caches, remember the updated set again.
+        remember_favorite_course_ids(ids - {str(course)}, base, access_token)
+    return resp
 
 
+@ttl_cache(3600)
 def get_course_tabs(course, base=None, access_token=None):
     """
     Lists the navigation tabs for the course.  Include external tools.
@@ -1270,7 +2910,7 @@ def get_course_tabs(course, base=None, access_token=None):
     """
 
     return contact_server(get_all_pages,
-                          "/api/v1/courses/{}/tabs".format(course),
+                          f"/api/v1/courses/{course}/tabs",
                           {'include[]': 'external'},
                           base, access_token)
 
@@ -1289,9 +2929,9 @@ def update_course_tab(course, tab, position, hidden=False,
         access_token: optional access token, if different from global one
     """
 
-    return contact_server(requests.put,
-                          "/api/v1/courses/{}/tabs/{}".format(course, tab),
-                          {'hidden': hidden, 'position': position},
+    return contact_server(session.put,
+                          f"/api/v1/courses/{course}/tabs/{tab}",
+                          {'hidden': int(bool(hidden)), 'position': position},
                           base, access_token)
 
 
@@ -1311,20 +2951,20 @@ def create_grading_standard(course, name, grades, cutoffs,
     """
 
     if len(cutoffs) == len(grades) - 1:
-        cutoffs += [0]
+        # A new list, so that the caller's list is not modified.
+        cutoffs = [*cutoffs, 0]
 
     # Canvas uses repeated header names and requires them in a specific order,
     # name, value, name, value.  I couldn't find a way to do that with
     # dictionaries, so now `contact_server` accepts lists of pairs as well.
 
-    params = [('title', name)]
-    for d in zip(grades, cutoffs):
-        params += [('grading_scheme_entry[][name]', d[0]),
-                   ('grading_scheme_entry[][value]', d[1])]
+    params = [('title', name)] + [
+        pair for grade, cutoff in zip(grades, cutoffs)
+        for pair in (('grading_scheme_entry[][name]', grade),
+                     ('grading_scheme_entry[][value]', cutoff))]
 
-    return contact_server(requests.post,
-                          "/api/v1/courses/{}/grading_standards".format(
-                              course),
+    return contact_server(session.post,
+                          f"/api/v1/courses/{course}/grading_standards",
                           params,
                           base, access_token)
 
@@ -1341,31 +2981,78 @@ def list_modules(course, items=False, details=False, search=None, student=None,
         items: a boolean, whether to include lists of items for each modules.
             Canvas may decide to ignore this if there are too many items.
         details: a boolean, whether to include additional details about items.
-            Required items to be true.
+            Implies items.
         search: search string to limit modules to those that match.
         student: include completion info for this student id.
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
 
+    Modules rarely change, so when caching is on (see `cache_ttl`), the
+    listing without a student is remembered for five minutes, see
+    `list_course_modules`.
+
     Returns:
         List of modules
     """
 
-    if items:
-        includes = [("include", ["items"] +
-                     ([] if not details else ["content_details"]))]
-    else:
-        includes = []
+    if student is None:
+        return list_course_modules(course, items, details, search, base,
+                                   access_token)
+    return fetch_modules(course, items, details, search, student, base,
+                         access_token)
+
+
+@ttl_cache(300)
+def list_course_modules(course, items=False, details=False, search=None,
+                        base=None, access_token=None):
+    """
+    Same as `list_modules` without a student, remembered for five minutes by
+    `ttl_cache`.
+    """
+    return fetch_modules(course, items, details, search, None, base,
+                         access_token)
+
+
+def fetch_modules(course, items, details, search, student, base,
+                  access_token):
+    "Does the actual listing for `list_modules`."
+
+    # include[] is a list, Canvas takes it as repeated fields.
+    params = compact_params({
+        'include[]': ["items", "content_details"] if details
+        else items and ["items"],
+        'search_term': search,
+        'student_id': student})
 
     return contact_server(get_all_pages,
-                          "/api/v1/courses/{}/modules".format(course),
-                          None if (not items and not search and not student)
-                          else dict(includes +
-                                    ([] if search is None
-                                        else [('search_term', search)]) +
-                                    ([] if student is None
-                                        else [('student_id', student)])),
-                          base, access_token)
+                          f"/api/v1/courses/{course}/modules",
+                          params, base, access_token)
+
+
+def list_modules_full(course, student=None, base=None, access_token=None):
+    """
+    Lists modules in a course together with all their items and the details
+    of the items, in a single listing instead of one request per module.
+    Only modules for which Canvas decided to leave out the items (if there
+    are too many of them) have them requested separately.
+
+    Parameters:
+        course: the course id
+        student: include completion info for this student id.
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+
+    Returns:
+        List of modules, each with its list of items under 'items'
+    """
+
+    # New dicts, the listed ones may be remembered by the caches.
+    return [module if 'items' in module else
+            {**module, 'items': list_module_items(
+                course, module['id'], details=True, student=student,
+                base=base, access_token=access_token)}
+            for module in list_modules(course, details=True, student=student,
+                                       base=base, access_token=access_token)]
 
 
 def show_module(course, module, items=False, details=False, student=None,
@@ -1388,20 +3075,14 @@ def show_module(course, module, items=False, details=False, student=None,
         Response with module info, when successful
     """
 
-    if items:
-        includes = [("include", ["items"] +
-                     ([] if not details else ["content_details"]))]
-    else:
-        includes = []
-
-    return contact_server(requests.get,
-                          "/api/v1/courses/{}/modules/{}".format(
-                              course, module),
-                          None if (not items and not student)
-                          else dict(includes +
-                                    ([] if student is None
-                                        else [('student_id', student)])),
-                          base, access_token)
+    params = compact_params({
+        'include[]': items and (["items", "content_details"] if details
+                                else ["items"]),
+        'student_id': student})
+
+    return contact_server(session.get,
+                          f"/api/v1/courses/{course}/modules/{module}",
+                          params, base, access_token)
 
 
 def create_module(course, name, position, unlock_at=None, sequential=False,
@@ -1426,21 +3107,15 @@ def create_module(course, name, position, unlock_at=None, sequential=False,
         a response with the module, if successful
     """
 
-    return contact_server(requests.post,
-                          "/api/v1/courses/{}/modules".format(course),
-                          dict([("module[name]", name),
-                                ("module[position]", position),
-                                ("module[require_sequential_progress]",
-                                 sequential),
-                                ("module[publish_final_grade]",
-                                 publish_final_grade)] +
-                               ([] if unlock_at is None
-                                else [("module[unlock_at]", unlock_at)]) +
-                               ([] if prereqs is None
-                                else [("module[prerequisite_module_ids]",
-                                       prereqs)])
-                               ),
-                          base, access_token)
+    params = form_data('module', name=name, position=position,
+                       unlock_at=unlock_at,
+                       require_sequential_progress=sequential,
+                       prerequisite_module_ids=prereqs,
+                       publish_final_grade=publish_final_grade)
+
+    return contact_server(session.post,
+                          f"/api/v1/courses/{course}/modules",
+                          params, base, access_token)
 
 
 def delete_module(course, module, base=None, access_token=None):
@@ -1457,16 +3132,19 @@ def delete_module(course, module, base=None, access_token=None):
         Response with module info, when successful
     """
 
-    return contact_server(requests.delete,
-                          "/api/v1/courses/{}/modules/{}".format(
-                              course, module),
+    return contact_server(session.delete,
+                          f"/api/v1/courses/{course}/modules/{module}",
                           None, base, access_token)
 
 
 # Module items
 
+MODULE_ITEMS_URL = "/api/v1/courses/{course}/modules/{module}/items"
+
+
+@stale_while_revalidate()
 def list_module_items(course, module, details=False, search=None, student=None,
-                      base=None, access_token=None):
+                      base=None, access_token=None, iterate=False):
     """
     Lists modules in a course.
 
@@ -1478,22 +3156,22 @@ def list_module_items(course, module, details=False, search=None, student=None,
         student: include completion info for this student id.
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
+        iterate: if true, return an iterator that yields the items one at a
+            time as they are downloaded, instead of a list.
 
     Returns:
         List of items
     """
 
-    return contact_server(get_all_pages,
-                          "/api/v1/courses/{}/modules/{}/items".format(
-                              course, module),
-                          None if (not details and not search and not student)
-                          else dict(([] if details is None
-                                     else [('include', ["content_details"])]) +
-                                    ([] if search is None
-                                        else [('search_term', search)]) +
-                                    ([] if student is None
-                                        else [('student_id', student)])),
-                          base, access_token)
+    params = compact_params({
+        'include[]': details and ["content_details"],
+        'search_term': search,
+        'student_id': student})
+
+    return contact_server(iter_streamed_pages if iterate else get_all_pages,
+                          MODULE_ITEMS_URL.format(course=course,
+                                                  module=module),
+                          params, base, access_token)
 
 
 def show_module_item(course, module, item, details=False, student=None,
@@ -1515,17 +3193,40 @@ def show_module_item(course, module, item, details=False, student=None,
         Response with item info, when successful
     """
 
+    params = compact_params({
+        'include[]': details and ["content_details"],
+        'student_id': student})
+
     return contact_server(
-        requests.get,
-        "/api/v1/courses/{}/modules/{}/items/{}".format(course,
-                                                        module,
-                                                        item),
-        None if (not details and not student)
-        else dict(([] if details is None
-                   else [('include', ["content_details"])]) +
-                  ([] if student is None
-                   else [('student_id', student)])),
-        base, access_token)
+        session.get,
+        MODULE_ITEMS_URL.format(course=course, module=module) +
+        "/{}".format(item),
+        params, base, access_token)
+
+
+def module_item_data(title, position, itemtype, indent=0, content=None,
+                     page_url=None, external_url=None, new_tab=True):
+    """
+    Builds the data describing a module item for `create_module_item`.  See
+    there for the meaning of the parameters.
+    """
+
+    # Some combinations are required while other are ignored.  Do not sort the
+    # mess right now and trust that caller knows what they are doing.
+
+    data = {"module_item[title]": title,
+            "module_item[type]": itemtype,
+            "module_item[position]": position,
+            "module_item[indent]": indent,
+            "module_item[new_tab]": int(bool(new_tab))}
+    if content is not None:
+        data["module_item[content_id]"] = content
+    if page_url is not None:
+        data["module_item[page_url]"] = page_url
+    if external_url is not None:
+        data["module_item[external_url]"] = external_url
+
+    return data
 
 
 def create_module_item(course, module, title, position, itemtype, indent=0,
@@ -1556,26 +3257,11 @@ def create_module_item(course, module, title, position, itemtype, indent=0,
         a response with the item, if successful
     """
 
-    # Some combinations are required while other are ignored.  Do not sort the
-    # mess right now and trust that caller knows what they are doing.
-
     return contact_server(
-        requests.post,
-        "/api/v1/courses/{}/modules/{}/items".format(course,
-                                                     module),
-        dict([("module_item[title]", title),
-              ("module_item[type]", itemtype),
-              ("module_item[position]", position),
-              ("module_item[indent]", indent),
-              ("module_item[new_tab]", (1 if new_tab else 0))
-              ] +
-             ([] if content is None
-              else [("module_item[content_id]", content)]) +
-             ([] if page_url is None
-              else [("module_item[page_url]", page_url)]) +
-             ([] if external_url is None
-              else [("module_item[external_url]", external_url)])
-             ),
+        session.post,
+        MODULE_ITEMS_URL.format(course=course, module=module),
+        module_item_data(title, position, itemtype, indent, content,
+                         page_url, external_url, new_tab),
         base, access_token)
 
 
@@ -1595,13 +3281,62 @@ def delete_module_item(course, module, item, base=None, access_token=None):
     """
 
     return contact_server(
-        requests.delete,
-        "/api/v1/courses/{}/modules/{}/items/{}".format(course,
-                                                        module,
-                                                        item),
+        session.delete,
+        MODULE_ITEMS_URL.format(course=course, module=module) +
+        "/{}".format(item),
         None, base, access_token)
 
 
+def create_module_items_bulk(course, module, items, base=None,
+                             access_token=None, workers=None):
+    """
+    Creates several items in the module, posting them concurrently.
+
+    Parameters:
+        course: the course id
+        module: module id
+        items: a list of dicts, each containing the keyword arguments of
+            `create_module_item` for one item (without `course`, `module`,
+            `base` and `access_token`)
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        workers: number of items posted to the server at the same time,
+            defaults to the global `max_workers`
+
+    Returns:
+        a list of responses, one for each item, in order
+    """
+
+    location = MODULE_ITEMS_URL.format(course=course, module=module)
+    return bulk([partial(contact_server, session.post, location,
+                         module_item_data(**item), base, access_token)
+                 for item in items], workers)
+
+
+def delete_module_items_bulk(course, module, items, base=None,
+                             access_token=None, workers=None):
+    """
+    Deletes several module items, concurrently.
+
+    Parameters:
+        course: the course id
+        module: module id
+        items: a list of item ids
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        workers: number of items deleted at the same time, defaults to the
+            global `max_workers`
+
+    Returns:
+        a list of responses, one for each item, in order
+    """
+
+    location = MODULE_ITEMS_URL.format(course=course, module=module) + "/{}"
+    return bulk([partial(contact_server, session.delete, location.format(item),
+                         None, base, access_token)
+                 for item in items], workers)
+
+
 # External tools API.  The whole external tools stuff is complicated and messy,
 # this here just creates a simple external tool in a course, with minimal
 # options.
@@ -1625,14 +3360,14 @@ def create_external_tool(course, name, privacy_level, key, secret,
         access_token: optional access token, if different from global one
     """
 
-    return contact_server(requests.post,
-                          "/api/v1/courses/{}/external_tools".format(course),
-                          dict([("name", name),
-                                ("privacy_level", privacy_level),
-                                ("consumer_key", key),
-                                ("shared_secret", secret),
-                                ("domain", domain)
-                                if url is None else ("url", url)]),
+    return contact_server(session.post,
+                          f"/api/v1/courses/{course}/external_tools",
+                          {"name": name,
+                           "privacy_level": privacy_level,
+                           "consumer_key": key,
+                           "shared_secret": secret,
+                           **({"domain": domain} if url is None
+                              else {"url": url})},
                           base, access_token)
 
 # Rubrics.  Rubrics in Canvas are a mess, and I do not understand them, but
@@ -1689,76 +3424,77 @@ def criterion_to_data(criterion, number, data=None):
     Parameters:
         criterion: a dict with a single criterion data
         number: a criterion number
-        data: an existing dict to which the data will be added
+        data: an existing list of pairs to which the data will be added
 
     Returns:
-        a dict with rubric data to send to server
+        a list of (field, value) pairs with rubric data to send to server
     """
 
     if data is None:
-        data = {}
+        data = []
 
-    data["rubric[criteria][{}][description]".format(
-        number)] = criterion['description']
+    prefix = f"rubric[criteria][{number}]"
+    data.append((prefix + "[description]", criterion['description']))
     if 'long_description' in criterion:
-        data['rubric[criteria][{}][long_description]'.format(
-            number)] = criterion['long_description']
-    data['rubric[criteria][{}][points]'.format(
-        number)] = criterion['points']  # Ignored?
+        data.append((prefix + "[long_description]",
+                     criterion['long_description']))
+    data.append((prefix + "[points]", criterion['points']))  # Ignored?
     if 'use_range' in criterion:
-        data['rubric[criteria][{}][criterion_use_range]'.format(
-            number)] = criterion['use_range']
+        data.append((prefix + "[criterion_use_range]",
+                     int(bool(criterion['use_range']))))
     if criterion['ratings']:
         for j, rating in enumerate(criterion['ratings']):
-            data['rubric[criteria][{}][ratings][{}][description]'.format(
-                number, j)] = rating['description']
-            data['rubric[criteria][{}][ratings][{}][points]'.format(
-                number, j)] = rating['points']
+            rating_prefix = f"{prefix}[ratings][{j}]"
+            data.append((rating_prefix + "[description]",
+                         rating['description']))
+            data.append((rating_prefix + "[points]", rating['points']))
     else:  # default ratings,  Canvas creates those but messes up the points!
-        data['rubric[criteria][{}][ratings][0][description]'.format(
-            number)] = "Full Points"
-        data['rubric[criteria][{}][ratings][0][points]'.format(
-            number)] = criterion['points']
-        data['rubric[criteria][{}][ratings][1][description]'.format(
-            number)] = "No Points"
-        data['rubric[criteria][{}][ratings][1][points]'.format(number)] = 0
+        data.append((prefix + "[ratings][0][description]", "Full Points"))
+        data.append((prefix + "[ratings][0][points]", criterion['points']))
+        data.append((prefix + "[ratings][1][description]", "No Points"))
+        data.append((prefix + "[ratings][1][points]", 0))
 
     return data
 
 
-def rubric_to_data(assignment, rubric, comments=True):
+def rubric_to_data(assignment, rubric, comments=True, data=None):
     """
     Translate a dict with rubric description to data to send to server.
 
     Parameters:
-        assignment: an assignment ID to associate the rubric with
+        assignment: an assignment ID to associate the rubric with, None
+            to leave the association alone
         rubric: a dict with rubric data.
         comments: whether to use free form comments when grading
+        data: an existing list of pairs to which the data will be added
 
     Returns:
-        a dict with rubric data to send to server
+        a list of (field, value) pairs with rubric data to send to server
     """
 
-    data = {
-        'rubric_association[association_id]': assignment,
-        'rubric_association[association_type]': 'Assignment',
-        'rubric_association[use_for_grading]': True,
-        'rubric_association[purpose]': 'grading',
-        'rubric[free_form_criterion_comments]': comments,
-        'rubric[title]': rubric['title'],
-        'rubric[description]': rubric['description']
-    }
+    if data is None:
+        data = []
+
+    if assignment is not None:
+        data += [('rubric_association[association_id]', assignment),
+                 ('rubric_association[association_type]', 'Assignment'),
+                 ('rubric_association[use_for_grading]', 1),
+                 ('rubric_association[purpose]', 'grading')]
+    data += [('rubric[free_form_criterion_comments]', int(bool(comments))),
+             ('rubric[title]', rubric['title']),
+             ('rubric[description]', rubric['description'])]
 
     if 'criteria' in rubric:
         for i, criterion in enumerate(rubric['criteria']):
-            data = criterion_to_data(criterion, i, data)
+            criterion_to_data(criterion, i, data)
 
     return data
 
 
 def create_rubric_for_assignment(course, assignment, rubric,
                                  comments=True,
-                                 base=None, access_token=None):
+                                 base=None, access_token=None,
+                                 compress=False):
     """
     Creates a new rubric and associate it to an assignment
 
@@ -1769,21 +3505,80 @@ def create_rubric_for_assignment(course, assignment, rubric,
         comments: whether to allow free style comments while grading.
         base: optional string, containing the base url of canvas server
         access_token: optional access token, if different from global one
+        compress: gzip the request body if it is large, see
+            `send_compressed`
+
+    Returns:
+        whatever it is that Canvas sends back
+    """
+
+    return contact_server(post_compressed if compress else session.post,
+                          f"/api/v1/courses/{course}/rubrics",
+                          rubric_to_data(assignment, rubric, comments),
+                          base, access_token)
+
+
+def update_rubric(course, rubricid, rubric, comments=True,
+                  base=None, access_token=None, compress=False):
+    """
+    Updates a whole rubric, its title, description and all its criteria, in
+    one request, instead of adding the criteria one at a time.
+
+    Parameters:
+        course: the course id
+        rubricid: an id of the rubric
+        rubric: a dict describing the rubric
+        comments: whether to allow free style comments while grading.
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        compress: gzip the request body if it is large, see
+            `send_compressed`
+
+    Returns:
+        whatever it is that Canvas sends back
+    """
+
+    return contact_server(put_compressed if compress else session.put,
+                          f"/api/v1/courses/{course}/rubrics/{rubricid}",
+                          rubric_to_data(None, rubric, comments),
+                          base, access_token)
+
+
+def add_criteria_to_rubric(course, rubricid, criteria, start_number=0,
+                           base=None, access_token=None, compress=False):
+    """
+    Adds several new criteria to a rubric, all in one request.
+
+    Parameters:
+        course: the course id
+        rubricid: an id of the rubric
+        criteria: a list of dicts describing the criteria
+        start_number: the number of the first of the criteria, the rest are
+            numbered consecutively
+        base: optional string, containing the base url of canvas server
+        access_token: optional access token, if different from global one
+        compress: gzip the request body if it is large, see
+            `send_compressed`
 
     Returns:
         whatever it is that Canvas sends back
     """
 
-    return contact_server(requests.post,
-                          "/api/v1/courses/{}/rubrics".format(course),
-                          data=rubric_to_data(assignment, rubric, comments)
-                          )
+    data = []
+    for number, criterion in enumerate(criteria, start_number):
+        criterion_to_data(criterion, number, data)
+
+    return contact_server(put_compressed if compress else session.put,
+                          f"/api/v1/courses/{course}/rubrics/{rubricid}",
+                          data, base, access_token)
 
 
 def add_criterion_to_rubric(course, rubricid, criterion, number,
                             base=None, access_token=None):
     """
-    Adds a new criterion to a rubric
+    Adds a new criterion to a rubric.  To add several, use
+    `add_criteria_to_rubric`, and to replace the whole rubric
+    `update_rubric`, which do it in one request.
 
     Parameters:
         course: the course id
@@ -1797,8 +3592,67 @@ def add_criterion_to_rubric(course, rubricid, criterion, number,
         whatever it is that Canvas sends back
     """
 
-    return contact_server(requests.put,
-                          "/api/v1/courses/{}/rubrics/{}".format(
-                              course, rubricid),
-                          data=criterion_to_data(criterion, number)
-                          )
+    return add_criteria_to_rubric(course, rubricid, [criterion], number,
+                                  base, access_token)
+
+
+async_slots = threading.BoundedSemaphore(max_workers)
+
+
+def make_async(function):
+    """
+    Makes an asyncio twin of a blocking function.  The twin runs the function
+    in a worker thread, so several calls awaited together (for example with
+    `asyncio.gather`) wait for the server at the same time.  To be polite to
+    the server, at most `max_workers` (as it was on import) of these calls
+    run at the same time, the rest wait for their turn.
+    """
+
+    def limited(*args, **kwargs):
+        with async_slots:
+            return function(*args, **kwargs)
+
+    async def twin(*args, **kwargs):
+        return await asyncio.to_thread(limited, *args, **kwargs)
+
+    twin.__name__ = 'a' + function.__name__
+    twin.__doc__ = 'Awaitable version of `{}`.\n{}'.format(
+        function.__name__, function.__doc__ or '')
+    return twin
+
+
+aget_list_of_courses = make_async(get_list_of_courses)
+aget_students = make_async(get_students)
+aget_enrollments = make_async(get_enrollments)
+aget_assignments = make_async(get_assignments)
+aget_submissions = make_async(get_submissions)
+aget_assignment_groups = make_async(get_assignment_groups)
+aget_groups = make_async(get_groups)
+aget_group_members = make_async(get_group_members)
+aget_groups_with_members = make_async(get_groups_with_members)
+aget_group_categories = make_async(get_group_categories)
+aget_favorite_courses = make_async(get_favorite_courses)
+aget_course_tabs = make_async(get_course_tabs)
+alist_modules = make_async(list_modules)
+alist_module_items = make_async(list_module_items)
+aupload_file_to_course = make_async(upload_file_to_course)
+aupload_files_bulk = make_async(upload_files_bulk)
+
+
+def iget_submissions(*args, **kwargs):
+    """
+    Same as `get_submissions` with `iterate=True`: yields the submissions one
+    at a time, parsed as they are downloaded when ijson is available.  Give
+    `base` and `access_token` as keyword arguments.
+    """
+    return get_submissions(*args, iterate=True, **kwargs)
+
+
+def iget_enrollments(*args, **kwargs):
+    "Same as `get_enrollments` with `iterate=True`."
+    return get_enrollments(*args, iterate=True, **kwargs)
+
+
+def ilist_module_items(*args, **kwargs):
+    "Same as `list_module_items` with `iterate=True`."
+    return list_module_items(*args, iterate=True, **kwargs)
@@ -0,0 +1,488 @@
+"""
+Checks of canvas.py that need no Canvas server.  Run with
+    python -m unittest discover tests
+"""
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from os import environ
+from os.path import dirname, join
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+
+import canvas  # noqa: E402
+
+
+class Response:
+    "Just enough of a requests.Response for canvas.py."
+
+    def __init__(self, body, status=200, headers=None, url=''):
+        self.content = json.dumps(body).encode()
+        self.status_code = status
+        self.headers = dict(headers or {})
+        self.url = url
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class MockSession:
+    """
+    Stands in for `canvas.session`.  Records the requests, and answers them
+    with `handler(verb, url, options)`.
+    """
+
+    def __init__(self, handler=None):
+        self.handler = handler or (lambda verb, url, options: Response({}))
+        self.headers = {}
+        self.calls = []
+
+    def request(self, verb, url, **options):
+        self.calls.append((verb, url, options))
+        return self.handler(verb, url, options)
+
+    def get(self, url, **options):
+        return self.request('GET', url, **options)
+
+    def post(self, url, **options):
+        return self.request('POST', url, **options)
+
+    def put(self, url, **options):
+        return self.request('PUT', url, **options)
+
+    def delete(self, url, **options):
+        return self.request('DELETE', url, **options)
+
+
+class MockSessionTest(unittest.TestCase):
+    "Runs each test with a `MockSession` and empty caches."
+
+    def setUp(self):
+        self.session = MockSession()
+        for name, value in [('session', self.session), ('cache_ttl', 0)]:
+            self.addCleanup(setattr, canvas, name, getattr(canvas, name))
+            setattr(canvas, name, value)
+        canvas.clear_cache()
+        self.addCleanup(canvas.clear_cache)
+
+    def verbs(self):
+        return [verb for verb, url, options in self.session.calls]
+
+
+@unittest.skipUnless(canvas.HAS_HTTPX, "needs httpx and h2")
+class AgetAllPagesTest(unittest.TestCase):
+    "The httpx path of `aget_all_pages`, against a mock transport."
+
+    def setUp(self):
+        self.requests = []
+        pages = 3
+
+        self.errors = {}
+
+        def handler(request):
+            self.requests.append(request)
+            page = int(request.url.params.get('page', 1))
+            if self.errors.get(page):
+                return self.errors[page].pop(0)
+            links = ''
+            if page < pages:
+                links = ('<https://canvas.test/a?page={}>; rel="next", '
+                         '<https://canvas.test/a?page={}>; rel="last"'
+                         ).format(page + 1, pages)
+            return canvas.httpx.Response(200, json=[{'page': page}],
+                                         headers={'Link': links})
+
+        transport = canvas.httpx.MockTransport(handler)
+        client = canvas.httpx.AsyncClient
+
+        def mock_client(**kwargs):
+            self.client_options = kwargs
+            return client(transport=transport, **kwargs)
+
+        canvas.httpx.AsyncClient = mock_client
+        self.addCleanup(setattr, canvas.httpx, 'AsyncClient', client)
+
+    def test_all_pages_in_order(self):
+        records = asyncio.run(canvas.aget_all_pages(
+            'https://canvas.test/a', None, {'Authorization': 'Bearer T'}))
+        self.assertEqual(records, [{'page': 1}, {'page': 2}, {'page': 3}])
+        self.assertEqual(len(self.requests), 3)
+
+    def test_rate_limit_retried(self):
+        self.errors[2] = [
+            canvas.httpx.Response(403, text='403 Forbidden '
+                                  '(Rate Limit Exceeded)',
+                                  headers={'Retry-After': '0'}),
+            canvas.httpx.Response(429, headers={'Retry-After': '0'})]
+        records = asyncio.run(canvas.aget_all_pages(
+            'https://canvas.test/a', None, {'Authorization': 'Bearer T'}))
+        self.assertEqual(records, [{'page': 1}, {'page': 2}, {'page': 3}])
+        self.assertEqual(len(self.requests), 5)
+
+    def test_error_page(self):
+        self.errors[3] = [canvas.httpx.Response(
+            404, json={'errors': [{'message': 'not found'}]})]
+        with self.assertRaises(canvas.CanvasHTTPError) as raised:
+            asyncio.run(canvas.aget_all_pages(
+                'https://canvas.test/a', None, {'Authorization': 'Bearer T'}))
+        self.assertEqual(raised.exception.status, 404)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_forbidden_not_retried(self):
+        self.errors[1] = [canvas.httpx.Response(403, text='Forbidden')]
+        with self.assertRaises(canvas.CanvasHTTPError) as raised:
+            asyncio.run(canvas.aget_all_pages(
+                'https://canvas.test/a', None, {'Authorization': 'Bearer T'}))
+        self.assertIsNone(raised.exception.payload)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_only_needed_headers(self):
+        asyncio.run(canvas.aget_all_pages(
+            'https://canvas.test/a', None, {'Authorization': 'Bearer T'}))
+        self.assertNotIn('Connection', self.client_options['headers'])
+        self.assertNotIn('limits', self.client_options)
+        for request in self.requests:
+            self.assertEqual(request.headers['Authorization'], 'Bearer T')
+            self.assertEqual(request.headers['User-Agent'],
+                             canvas.session.headers['User-Agent'])
+
+
+class CacheTest(MockSessionTest):
+    "The caches shared by the worker threads of the concurrent helpers."
+
+    def test_off_by_default(self):
+        # In a fresh interpreter, whatever the environment of this one.
+        env = {name: value for name, value in environ.items()
+               if name not in ('CANVAS_CACHE_TTL', 'CANVAS_CACHE')}
+        settings = subprocess.run(
+            [sys.executable, '-c',
+             'import canvas; print(canvas.cache_ttl, canvas.user_cache_file,'
+             ' canvas.markdown_cache_dir)'],
+            cwd=join(dirname(__file__), '..'), env=env, check=True,
+            capture_output=True, text=True).stdout.split()
+        self.assertEqual(settings, ['0', 'None', 'None'])
+
+    def test_cleared_by_changes(self):
+        canvas.cache_ttl = 60
+        for verb in ['post', 'put', 'delete']:
+            with self.subTest(verb=verb):
+                canvas.clear_cache()
+                self.session.calls.clear()
+                for n in range(2):
+                    canvas.contact_server(self.session.get, '/api/v1/x',
+                                          access_token='T')
+                canvas.contact_server(verb, '/api/v1/x', {'a': 1},
+                                      access_token='T')
+                canvas.contact_server(self.session.get, '/api/v1/x',
+                                      access_token='T')
+                self.assertEqual(self.verbs(), ['GET', verb.upper(), 'GET'])
+
+    def test_stale_while_revalidate(self):
+        canvas.cache_ttl = 60
+        calls = []
+
+        @canvas.stale_while_revalidate(0.05)
+        def listing():
+            calls.append(None)
+            return [len(calls)]
+
+        self.assertEqual(listing(), [1])
+        self.assertEqual(listing(), [1])
+        time.sleep(0.1)
+        # Too old, but still in the grace period: returned at once, while
+        # a fresh one is fetched in the background.
+        self.assertEqual(listing(), [1])
+        deadline = time.monotonic() + 5
+        while listing() != [2] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(listing(), [2])
+        self.assertEqual(len(calls), 2)
+
+    def test_remember_from_many_threads(self):
+        cache = {}
+        self.addCleanup(cache.clear)
+
+        def fill(start):
+            for key in range(start, start + 5 * canvas.cache_size):
+                canvas.remember(cache, key, key)
+
+        threads = [canvas.threading.Thread(target=fill, args=(n * 10000,))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(len(cache), canvas.cache_size)
+
+
+class SubmissionUrlTest(unittest.TestCase):
+    "The locations of single submissions."
+
+    def test_submission_urls(self):
+        self.assertEqual(
+            canvas.submission_urls(11, 22, [33, 44]),
+            ['/api/v1/courses/11/assignments/22/submissions/33',
+             '/api/v1/courses/11/assignments/22/submissions/44'])
+
+    def test_single_submission(self):
+        calls = []
+        contact_server = canvas.contact_server
+        canvas.contact_server = lambda *args, **kwargs: calls.append(args)
+        self.addCleanup(setattr, canvas, 'contact_server', contact_server)
+        canvas.get_submissions(11, assignment=22, student=33)
+        self.assertEqual(calls[0][:2], (
+            canvas.get_json,
+            '/api/v1/courses/11/assignments/22/submissions/33'))
+
+
+class PagesTest(MockSessionTest):
+    "Listings with a 'last' link, whose pages are fetched concurrently."
+
+    def test_pages_in_order(self):
+        pages = 6
+
+        def handler(verb, url, options):
+            page = int(dict(parse_qsl(urlsplit(url).query)).get('page', 1))
+            # The later pages arrive first.
+            time.sleep((pages - page) * 0.01)
+            links = ''
+            if page == 1:
+                links = ('<https://canvas.test/a?page=2>; rel="next", '
+                         '<https://canvas.test/a?page={}>; rel="last"'
+                         ).format(pages)
+            return Response([page * 10, page * 10 + 1],
+                            headers={'Link': links})
+
+        self.session.handler = handler
+        self.assertEqual(
+            canvas.get_all_pages('https://canvas.test/a', None,
+                                 {'Authorization': 'Bearer T'}),
+            [record for page in range(1, pages + 1)
+             for record in (page * 10, page * 10 + 1)])
+        self.assertEqual(len(self.session.calls), pages)
+
+
+class GradeDataTest(unittest.TestCase):
+    "The form fields of grades and comments."
+
+    def test_one_assignment(self):
+        self.assertEqual(
+            canvas.form_fields(canvas.create_grade_data(
+                {5: 90, 6: 80}, 3, comments={6: 'late', 7: 'absent'})),
+            [('grade_data[3][5][posted_grade]', 90),
+             ('grade_data[3][6][posted_grade]', 80),
+             ('grade_data[3][6][text_comment]', 'late'),
+             ('grade_data[3][7][text_comment]', 'absent')])
+
+    def test_many_assignments(self):
+        self.assertEqual(
+            canvas.form_fields(canvas.create_grade_data(
+                {3: {5: 'A'}, 4: {5: 'B'}}, comments={4: {5: 'good'}})),
+            [('grade_data[3][5][posted_grade]', 'A'),
+             ('grade_data[4][5][posted_grade]', 'B'),
+             ('grade_data[4][5][text_comment]', 'good')])
+
+
+class CopyTest(MockSessionTest):
+    "Remembered results are not changed through the copies callers get."
+
+    def test_response_cache(self):
+        canvas.cache_ttl = 60
+        self.session.handler = lambda verb, url, options: Response(
+            {'score': 1, 'comments': []})
+        submission = canvas.get_submissions(3, assignment=4, student=5,
+                                            access_token='T')
+        submission['comments'].append('changed')
+        self.assertEqual(
+            canvas.get_submissions(3, assignment=4, student=5,
+                                   access_token='T'),
+            {'score': 1, 'comments': []})
+        self.assertEqual(self.verbs(), ['GET'])
+
+    def test_etag(self):
+        def handler(verb, url, options):
+            if 'If-None-Match' in options['headers']:
+                return Response(None, 304)
+            return Response({'comments': []}, headers={'ETag': '"1"'})
+
+        self.session.handler = handler
+        for n in range(2):
+            result = canvas.contact_server(canvas.get_json, '/api/v1/x',
+                                           access_token='T')
+            self.assertEqual(result, {'comments': []})
+            result['comments'].append('changed')
+        self.assertEqual(len(self.session.calls), 2)
+
+
+class ModulesTest(MockSessionTest):
+    "The module listing without a student is remembered for longer."
+
+    def test_list_modules(self):
+        canvas.cache_ttl = 60
+        self.session.handler = lambda verb, url, options: Response(
+            [{'id': 1}])
+        for n in range(2):
+            self.assertEqual(canvas.list_modules(2, access_token='T'),
+                             [{'id': 1}])
+        expires = [entry[0] for key, entry in canvas.function_cache.items()
+                   if key[0] == 'list_course_modules']
+        self.assertEqual(len(expires), 1)
+        self.assertGreater(expires[0], canvas.time.monotonic() + 200)
+        canvas.list_modules(2, student=3, access_token='T')
+        self.assertEqual(self.verbs(), ['GET', 'GET'])
+
+
+class FavoritesTest(MockSessionTest):
+    "Adding and removing favorite courses."
+
+    def test_request_always_sent(self):
+        resp = canvas.add_course_to_favorites(7, access_token='T')
+        self.assertTrue(resp.ok)
+        resp = canvas.remove_course_from_favorites(7, access_token='T')
+        self.assertTrue(resp.ok)
+        self.assertEqual(self.verbs(), ['POST', 'DELETE'])
+
+    def test_remembered_favorites(self):
+        canvas.cache_ttl = 60
+        self.session.handler = lambda verb, url, options: Response(
+            [{'id': 7}] if verb == 'GET' else {})
+        self.assertEqual(canvas.favorite_course_ids(access_token='T'), {'7'})
+        self.assertIsNone(canvas.add_course_to_favorites(7, access_token='T'))
+        canvas.add_course_to_favorites(8, access_token='T')
+        self.assertEqual(canvas.favorite_course_ids(access_token='T'),
+                         {'7', '8'})
+        self.assertEqual(self.verbs(), ['GET', 'POST'])
+
+
+class UserCacheTest(unittest.TestCase):
+    "The user ids remembered between runs."
+
+    def setUp(self):
+        self.addCleanup(setattr, canvas, 'user_cache_file',
+                        canvas.user_cache_file)
+
+    def test_off(self):
+        canvas.user_cache_file = None
+        canvas.remember_user_id('someone', 1, 'https://canvas.test/')
+        self.assertIsNone(
+            canvas.cached_user_id('someone', 'https://canvas.test/'))
+
+    def test_remember_from_many_threads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            canvas.user_cache_file = join(directory, 'user_ids')
+
+            def fill(thread):
+                for n in range(30):
+                    canvas.remember_user_id(f'{thread}-{n}', n,
+                                            'https://canvas.test/')
+
+            threads = [canvas.threading.Thread(target=fill, args=(n,))
+                       for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(
+                [canvas.cached_user_id(f'{thread}-{n}',
+                                       'https://canvas.test/')
+                 for thread in range(8) for n in range(30)],
+                [n for thread in range(8) for n in range(30)])
+
+
+class EnrollTest(MockSessionTest):
+    "Enrolling users by their sis_login_id."
+
+    def test_enroll_users(self):
+        def handler(verb, url, options):
+            user = options['data']['enrollment[user_id]']
+            if user == 'sis_login_id:nobody':
+                return Response({'errors': []}, 404)
+            return Response({'user_id': len(user)})
+
+        self.session.handler = handler
+        self.addCleanup(setattr, canvas, 'user_cache_file',
+                        canvas.user_cache_file)
+        with tempfile.TemporaryDirectory() as directory:
+            canvas.user_cache_file = join(directory, 'user_ids')
+            results = canvas.enroll_users_by_login_id(
+                5, ['someone', 'nobody'], 'https://canvas.test/', 'T')
+            self.assertEqual({login_id: resp.status_code
+                              for login_id, resp in results.items()},
+                             {'someone': 200, 'nobody': 404})
+            self.assertEqual(self.verbs(), ['POST', 'POST'])
+            self.assertEqual(
+                canvas.cached_user_id('someone', 'https://canvas.test/'),
+                len('sis_login_id:someone'))
+            self.assertIsNone(
+                canvas.cached_user_id('nobody', 'https://canvas.test/'))
+
+
+class MarkdownBatchTest(unittest.TestCase):
+    "Converting many markdown bodies with one pandoc run."
+
+    def setUp(self):
+        self.runs = []
+
+        def run_pandoc(text):
+            self.runs.append(text)
+            return text.upper()
+
+        for name, value in [('HAS_PANDOC', True), ('run_pandoc', run_pandoc),
+                            ('markdown_cache_dir', None)]:
+            self.addCleanup(setattr, canvas, name, getattr(canvas, name))
+            setattr(canvas, name, value)
+        for clear in [canvas.pandoc_cache.clear,
+                      canvas.cached_convert_markdown.cache_clear]:
+            clear()
+            self.addCleanup(clear)
+
+    def test_split(self):
+        bodies = ['*a*', '**b**', 'c\n\nd']
+        self.assertEqual(canvas.convert_markdown_batch(bodies, True),
+                         ['*A*\n', '**B**\n', 'C\n\nD\n'])
+        self.assertEqual(len(self.runs), 1)
+        self.assertEqual(len(canvas.PANDOC_SPLIT.findall(self.runs[0])), 3)
+
+    def test_definitions_alone(self):
+        bodies = ['a[^1]\n\n[^1]: note', 'b [x]\n\n[x]: http://x',
+                  '# Intro\n\nc', '# intro!\n\nd', 'e']
+        self.assertEqual(canvas.convert_markdown_batch(bodies, True),
+                         ['A[^1]\n\n[^1]: NOTE', 'B [X]\n\n[X]: HTTP://X',
+                          '# INTRO\n\nC\n', '# INTRO!\n\nD', 'E\n'])
+        # One run for '# Intro' and 'e', one for each of the others.
+        self.assertEqual(len(self.runs), 4)
+        self.assertEqual(sorted(canvas.header_names(bodies[2])), ['intro'])
+
+    def test_results_remembered(self):
+        bodies = ['a', 'b', 'c']
+        first = canvas.convert_markdown_batch(bodies, True)
+        self.assertEqual(canvas.convert_markdown_batch(bodies, True), first)
+        self.assertEqual(canvas.convert_markdown('b', True), 'B\n')
+        self.assertEqual(len(self.runs), 1)
+
+
+class UploadTest(unittest.TestCase):
+    "The checks done before a file upload starts."
+
+    def test_empty_file_rejected(self):
+        sent = []
+        post = canvas.session.post
+        canvas.session.post = lambda *args, **kwargs: sent.append(args)
+        self.addCleanup(setattr, canvas.session, 'post', post)
+        with tempfile.NamedTemporaryFile() as empty:
+            with self.assertRaises(ValueError):
+                canvas.upload_file_to_course(1, empty.name, 'uploads')
+        self.assertEqual(sent, [])
+
+
+if __name__ == '__main__':
+    unittest.main()